@@ -8,7 +8,9 @@ def create_video_with_mixed_audio(
     main_audio_path, 
     temp_dir="temp",  # Directory for temporary files
     bg_volume=0.3,
-    main_audio_volume=1.0
+    main_audio_volume=1.0,
+    output_path=None,
+    video_codec="copy"
 ):
     """
     Create a video with mixed audio (main audio + background music)
@@ -20,6 +22,10 @@ def create_video_with_mixed_audio(
         temp_dir (str): Directory for temporary files
         bg_volume (float): Volume level for background music (0.0-1.0)
         main_audio_volume (float): Volume level for main audio (0.0-1.0)
+        output_path (str): Where to write the final video (defaults to
+            output_video.mp4 in temp_dir)
+        video_codec (str): ffmpeg video codec; "copy" remuxes the original
+            stream, and falls back to libx264 if the container rejects it
         
     Returns:
         bool: True if successful, False otherwise
@@ -31,7 +37,7 @@ def create_video_with_mixed_audio(
         
         # Define paths for temporary and output files
         temp_audio_path = os.path.join(temp_dir, "mixed_audio.wav")
-        output_video_path = os.path.join(temp_dir, "output_video.mp4")
+        output_video_path = output_path or os.path.join(temp_dir, "output_video.mp4")
         
         # Step 1: Mix the background audio and main audio with volume control
         print("Step 1: Mixing audio tracks...")
@@ -44,12 +50,22 @@ def create_video_with_mixed_audio(
         subprocess.run(mix_command, shell=True, check=True)
         
         # Step 2: Replace the original audio in the video with mixed audio
+        # (by default the video stream is copied as-is; only the new audio track is encoded)
         print("Step 2: Creating final video with mixed audio...")
-        video_command = f'''ffmpeg -i "{main_video_path}" -i "{temp_audio_path}" \
-            -c:v copy -map 0:v:0 -map 1:a:0 -shortest -c:a aac \
-            "{output_video_path}" -y'''
+        def mux(codec):
+            video_command = f'''ffmpeg -i "{main_video_path}" -i "{temp_audio_path}" \
+                -c:v {codec} -map 0:v:0 -map 1:a:0 -shortest -c:a aac -b:a 192k \
+                "{output_video_path}" -y'''
+            subprocess.run(video_command, shell=True, check=True)
         
-        subprocess.run(video_command, shell=True, check=True)
+        try:
+            mux(video_codec)
+        except subprocess.CalledProcessError:
+            if video_codec != "copy":
+                raise
+            # e.g. a VP9/AV1 source that the MP4 muxer won't take as-is
+            print("Stream copy failed, re-encoding the video track...")
+            mux("libx264")
         
         # Check if output file exists and has a reasonable size
         if os.path.exists(output_video_path) and os.path.getsize(output_video_path) > 1000:
@@ -1,8 +1,10 @@
 import os
 import sys
 import logging
+import torch
 from dotenv import load_dotenv
-import re
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 # Set COQUI_TOS_AGREED to 1 to automatically accept the Terms of Service for Coqui TTS models
 os.environ['COQUI_TOS_AGREED'] = '1'
@@ -17,14 +19,35 @@ from media_ingestion import MediaIngester
 from speech_recognition import SpeechRecognizer
 from speech_diarization import SpeakerDiarizer
 from translate import translate_text, generate_srt_subtitles
-from text_to_speech import generate_tts  # Import both TTS functions
+from text_to_speech import generate_tts, parse_speaker_id
 from audio_to_video import create_video_with_mixed_audio
 
-def create_directories(dirs):
-    """Create necessary directories"""
-    for directory in dirs:
+WORK_DIRS = ("temp", "audio", "audio2", "reference_audio")
+
+def _ensure_dirs():
+    """Create the working directories"""
+    for directory in WORK_DIRS:
         os.makedirs(directory, exist_ok=True)
 
+def _make_voice_cfg(speaker_id, speaker, reference_files, target_language, logger):
+    """Build the TTS configuration for one speaker, asking for a gender when Edge TTS is used"""
+    if reference_files is not None:
+        if speaker in reference_files:
+            logger.info(f"Using voice cloning for Speaker {speaker_id+1} with reference file: {os.path.basename(reference_files[speaker])}")
+            return {
+                'engine': 'xtts',
+                'reference_audio': reference_files[speaker],
+                'language': target_language
+            }
+        # Fallback to Edge TTS if no reference audio
+        logger.warning(f"No reference audio found for Speaker {speaker_id+1}, falling back to Edge TTS")
+    
+    gender = input(f"Select voice gender for Speaker {speaker_id+1} (m/f): ").lower()
+    return {
+        'engine': 'edge_tts',
+        'gender': "female" if gender.startswith("f") else "male"
+    }
+
 def main():
     # Load environment variables
     load_dotenv()
@@ -34,7 +57,7 @@ def main():
     logger = logging.getLogger(__name__)
     
     # Create necessary directories
-    create_directories(["temp", "audio", "audio2", "reference_audio"])
+    _ensure_dirs()
     
     # Get API tokens
     hf_token = os.getenv("HUGGINGFACE_TOKEN")
@@ -54,105 +77,92 @@ def main():
     tts_choice = input("Enter choice (1/2): ").strip()
     use_voice_cloning = tts_choice == "2"
     
+    # Choose translation method (groq_batch submits an offline Groq Batch API job)
+    translation_method = input("Translation method (batch/iterative/groq/groq_batch) [batch]: ").strip() or "batch"
+    
     # Initialize components
     logger.info("Initializing pipeline components...")
     ingester = MediaIngester(output_dir="temp")
-    recognizer = SpeechRecognizer(model_size="base")
-    diarizer = SpeakerDiarizer(hf_token=hf_token)
+    recognizer = SpeechRecognizer(
+        model_size="base",
+        compute_type=os.getenv("WHISPER_COMPUTE_TYPE"),  # e.g. "float16", "int8_float16"
+        batch_size=int(os.getenv("WHISPER_BATCH_SIZE", "16"))
+    )
+    diarizer = SpeakerDiarizer(
+        hf_token=hf_token, embedding_batch_size=8, segmentation_batch_size=8,
+        backend=os.getenv("DIARIZATION_BACKEND", "pyannote")
+    )
     
     # Step 1: Process input and extract audio
     logger.info("Processing media source...")
     video_path = ingester.process_input(media_source)
-    audio_path = ingester.extract_audio(video_path)
-    clean_audio_path, bg_audio_path = ingester.separate_audio_sources(audio_path)
-    logger.info("Extracted audio: %s", audio_path)
+    clean_audio_path, bg_audio_path, speech = ingester.extract_and_separate(video_path, speech_sample_rate=16000)
     logger.info("Cleaned audio: %s", clean_audio_path)
     logger.info("Background audio: %s", bg_audio_path)
     logger.info("Audio processing completed.")
     
-    # Step 2: Perform speech recognition
-    logger.info("Transcribing audio...")
-    segments = recognizer.transcribe(clean_audio_path)
-    
-    # Step 3: Perform speaker diarization
-    logger.info("Identifying speakers...")
-    
     # Add user input for max speakers
     max_speakers_str = input("Maximum number of speakers to detect (leave blank for auto): ")
     max_speakers = int(max_speakers_str) if max_speakers_str.strip() else None
 
-    # Then call diarize with this parameter
-    speakers = diarizer.diarize(clean_audio_path, max_speakers=max_speakers)
+    def identify_speakers():
+        """Diarize, then cut each speaker's reference clip when voice cloning"""
+        speakers = diarizer.diarize(
+            {"waveform": torch.from_numpy(speech)[None], "sample_rate": 16000},
+            max_speakers=max_speakers
+        )
+        reference_files = None
+        if use_voice_cloning:
+            # Extract reference audio for voice cloning
+            logger.info("Extracting speaker reference audio for voice cloning...")
+            reference_files = diarizer.extract_speaker_references(
+                clean_audio_path, 
+                speakers, 
+                output_dir="reference_audio"
+            )
+        return speakers, reference_files
+
+    # Steps 2-3: Diarization (plus reference extraction) only needs the separated
+    # voice, so it runs in the background during transcription and translation
+    logger.info("Identifying speakers...")
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        speakers_future = executor.submit(identify_speakers)
+        
+        logger.info("Transcribing audio...")
+        segments = recognizer.transcribe(speech)
+        
+        logger.info(f"Translating to {target_language}...")
+        translated_segments = translate_text(
+            segments,
+            target_lang=target_language,
+            translation_method=translation_method  # "batch", "iterative", "groq" or "groq_batch"
+        )
+        speakers, reference_files = speakers_future.result()
     
-    # Step 4: Assign speakers to segments
+    # Step 4: Assign speakers to the translated segments
     logger.info("Assigning speakers to segments...")
-    final_segments = diarizer.assign_speakers_to_segments(segments, speakers)
-    
-    # Step 5: Translate the segments
-    logger.info(f"Translating to {target_language}...")
-    translated_segments = translate_text(
-        final_segments, 
-        target_lang=target_language,
-        translation_method="batch"  # Can be "batch" or "iterative" or "groq"
-    )
+    translated_segments = diarizer.assign_speakers_to_segments(translated_segments, speakers)
 
     # Print translated segments for debugging
-    subtitle_file = f"temp/{os.path.basename(video_path).split('.')[0]}_{target_language}.srt"
+    subtitle_file = f"temp/{Path(video_path).stem}_{target_language}.srt"
     generate_srt_subtitles(translated_segments, output_file=subtitle_file)
     logger.info(f"Generated subtitle file: {subtitle_file}")
     
     # Step 6: Configure voice characteristics for speakers
-    voice_config = {}  # Map of speaker_id to gender or voice config
-
-    # Detect number of unique speakers
-    unique_speakers = set()
+    # Map of speaker_id to voice config, built in one pass over the segments
+    voice_config = {}
+    seen = set()
     for segment in translated_segments:
-        if 'speaker' in segment:
-            unique_speakers.add(segment['speaker'])
-    
-    logger.info(f"Detected {len(unique_speakers)} speakers")
-    
-    if use_voice_cloning:
-        # Extract reference audio for voice cloning
-        logger.info("Extracting speaker reference audio for voice cloning...")
-        reference_files = diarizer.extract_speaker_references(
-            clean_audio_path, 
-            speakers, 
-            output_dir="reference_audio"
-        )
-        
-        # Create voice config for XTTS
-        for speaker in sorted(list(unique_speakers)):
-            match = re.search(r'SPEAKER_(\d+)', speaker)
-            if match:
-                speaker_id = int(match.group(1))
-                if speaker in reference_files:
-                    voice_config[speaker_id] = {
-                        'engine': 'xtts',
-                        'reference_audio': reference_files[speaker],
-                        'language': target_language
-                    }
-                    logger.info(f"Using voice cloning for Speaker {speaker_id+1} with reference file: {os.path.basename(reference_files[speaker])}")
-                else:
-                    # Fallback to Edge TTS if no reference audio
-                    logger.warning(f"No reference audio found for Speaker {speaker_id+1}, falling back to Edge TTS")
-                    gender = input(f"Select voice gender for Speaker {speaker_id+1} (m/f): ").lower()
-                    voice_config[speaker_id] = {
-                        'engine': 'edge_tts',
-                        'gender': "female" if gender.startswith("f") else "male"
-                    }
-    else:
-        # Standard Edge TTS configuration - keeping your current approach
-        if len(unique_speakers) > 0:
-            for speaker in sorted(list(unique_speakers)):
-                match = re.search(r'SPEAKER_(\d+)', speaker)
-                if match:
-                    speaker_id = int(match.group(1))
-                    gender = input(f"Select voice gender for Speaker {speaker_id+1} (m/f): ").lower()
-                    voice_config[speaker_id] = {
-                        'engine': 'edge_tts',
-                        'gender': "female" if gender.startswith("f") else "male"
-                    }
+        speaker = segment.get('speaker')
+        if not speaker or speaker in seen:
+            continue
+        seen.add(speaker)
+        speaker_id = parse_speaker_id(speaker)
+        if speaker_id is None or speaker_id in voice_config:
+            continue
+        voice_config[speaker_id] = _make_voice_cfg(speaker_id, speaker, reference_files, target_language, logger)
+    
+    logger.info(f"Detected {len(voice_config)} speakers")
     
     # Step 7: Generate speech in target language
     logger.info("Generating speech...")
@@ -2,11 +2,17 @@ import os
 import sys
 import logging
 import tempfile
-import re
 import gradio as gr
 from dotenv import load_dotenv
 import threading
 import shutil
+import queue
+import time
+from functools import lru_cache
+import numpy as np
+import torch
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Set COQUI_TOS_AGREED to 1 to automatically accept the Terms of Service for Coqui TTS models
 os.environ['COQUI_TOS_AGREED'] = '1'
@@ -17,29 +23,182 @@ if current_dir not in sys.path:
     sys.path.append(current_dir)
 
 # Import the required modules
-from media_ingestion import MediaIngester
+from media_ingestion import MediaIngester, get_demucs_model, separation_overlap
 from speech_recognition import SpeechRecognizer
-from speech_diarization import SpeakerDiarizer
+from speech_diarization import SpeakerDiarizer, compile_kernels
 from translate import translate_text, generate_srt_subtitles
-from text_to_speech import generate_tts
+from text_to_speech import generate_tts, parse_speaker_id, XTTSModelLoader
 from audio_to_video import create_video_with_mixed_audio
+import pipeline_cache
 
-# Load environment variables
-load_dotenv()
+@lru_cache(maxsize=1)
+def _load_env():
+    """Load environment variables from .env once, on first use rather than at import"""
+    load_dotenv()
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Create necessary directories
-os.makedirs("temp", exist_ok=True)
-os.makedirs("audio", exist_ok=True)
-os.makedirs("audio2", exist_ok=True)
-os.makedirs("reference_audio", exist_ok=True)
-os.makedirs("outputs", exist_ok=True)  # Add directory for downloadable outputs
+# Working directories, created once on the first request
+WORK_DIRS = ("temp", "outputs")  # outputs holds downloadable files; runs work in temp/<run_id>
+_DIRS_READY = False
 
-# Global variables for process tracking
-processing_status = {}
+# Per-run scratch files (TTS segments, dubbed track, reference clips) go to
+# tmpfs when it has room: they are short-lived and never need to reach the
+# disk. Downloads and separated stems can be large and stay in temp/.
+SHM_ROOT = "/dev/shm/syncdub"
+# Containers often give /dev/shm only 64 MB; below this much free space the
+# scratch files stay on disk instead
+SHM_MIN_FREE = 1 << 30  # 1 GiB
+
+def _scratch_dir(run_id, work_dir):
+    """
+    Pick a run's scratch directory: under SYNCDUB_SCRATCH_DIR if set, else on
+    /dev/shm if it has SHM_MIN_FREE free, else inside the run's work_dir
+    """
+    root = os.getenv("SYNCDUB_SCRATCH_DIR")
+    if root:
+        return os.path.join(root, run_id)
+    try:
+        if shutil.disk_usage("/dev/shm").free >= SHM_MIN_FREE:
+            return os.path.join(SHM_ROOT, run_id)
+    except OSError:
+        pass  # No /dev/shm (e.g. on Windows or macOS)
+    return os.path.join(work_dir, "scratch")
+
+def _ensure_dirs():
+    """Create the working directories once per process"""
+    global _DIRS_READY
+    if _DIRS_READY:
+        return
+    for directory in WORK_DIRS:
+        os.makedirs(directory, exist_ok=True)
+    _DIRS_READY = True
+
+# Shared pool for pipeline stages that run alongside the main request thread
+_EXECUTOR = ThreadPoolExecutor(max_workers=8)
+
+def _discard(path):
+    """
+    Delete a run's directory without blocking the request: it is renamed into
+    a .trash directory next to it (atomic, same filesystem) and removed by the
+    executor in the background
+    """
+    trash_dir = os.path.join(os.path.dirname(path), ".trash")
+    garbage = os.path.join(trash_dir, os.path.basename(path))
+    try:
+        os.makedirs(trash_dir, exist_ok=True)
+        os.replace(path, garbage)
+    except OSError:
+        # Already gone, or can't be moved; fall back to deleting in place
+        garbage = path
+    _EXECUTOR.submit(shutil.rmtree, garbage, ignore_errors=True)
+
+def _empty_trash():
+    """Remove anything a previous process left in the .trash directories"""
+    _load_env()
+    for root in ("temp", SHM_ROOT, os.getenv("SYNCDUB_SCRATCH_DIR")):
+        if root:
+            shutil.rmtree(os.path.join(root, ".trash"), ignore_errors=True)
+
+# Models are loaded once per process and reused across requests
+_MODEL_POOL = {}
+_MODEL_POOL_LOCK = threading.Lock()
+
+def _get_pooled(key, factory):
+    """Return the pooled instance for the given key, creating it on first use"""
+    with _MODEL_POOL_LOCK:
+        if key not in _MODEL_POOL:
+            _MODEL_POOL[key] = factory()
+        return _MODEL_POOL[key]
+
+def get_recognizer(model_size="base", device=None):
+    """Get the shared speech recognizer for the given Whisper model size and device"""
+    return _get_pooled(("asr", model_size, device), lambda: SpeechRecognizer(
+        model_size=model_size,
+        device=device,
+        compute_type=os.getenv("WHISPER_COMPUTE_TYPE"),  # e.g. "float16", "int8_float16"
+        batch_size=int(os.getenv("WHISPER_BATCH_SIZE", "16"))
+    ))
+
+def get_diarizer(hf_token, device=None):
+    """Get the shared speaker diarizer for the given token and device"""
+    backend = os.getenv("DIARIZATION_BACKEND", "pyannote")  # "pyannote" or "simple"
+    key = ("diarizer", hf_token, device, backend)
+    diarizer = _get_pooled(key, lambda: SpeakerDiarizer(
+        hf_token=hf_token, device=device, embedding_batch_size=8, segmentation_batch_size=8, backend=backend
+    ))
+    if not diarizer.is_available():
+        # Loading failed; don't keep the broken instance so the next request retries
+        with _MODEL_POOL_LOCK:
+            _MODEL_POOL.pop(key, None)
+    return diarizer
+
+# Each request leases one device; with several GPUs, concurrent requests run
+# on different GPUs, each with its own warm models from the pool above
+_FREE_DEVICES = None
+_FREE_DEVICES_LOCK = threading.Lock()
+
+def _device_queue():
+    """Build the queue of leasable devices on first use"""
+    global _FREE_DEVICES
+    with _FREE_DEVICES_LOCK:
+        if _FREE_DEVICES is None:
+            if torch.cuda.is_available():
+                devices = [f"cuda:{i}" for i in range(torch.cuda.device_count())]
+            else:
+                devices = ["cpu"]
+            _FREE_DEVICES = queue.Queue()
+            for device in devices:
+                _FREE_DEVICES.put(device)
+        return _FREE_DEVICES
+
+def acquire_device():
+    """Lease a device for one request, waiting until one is free"""
+    return _device_queue().get()
+
+def release_device(device):
+    """Return a leased device to the pool"""
+    _device_queue().put(device)
+
+def _make_voice_cfg(speaker_id, speaker, reference_files, speaker_genders, target_language):
+    """
+    Build the TTS configuration for one speaker
+    
+    Args:
+        speaker_id: Numeric speaker id
+        speaker: Diarization label (e.g. "SPEAKER_00")
+        reference_files: Dict of speaker label to reference audio for voice cloning, or None for Edge TTS
+        speaker_genders: Dict of str(speaker_id) to the gender selected in the UI
+        target_language: Validated target language code
+        
+    Returns:
+        XTTS config dict, Edge TTS config dict, or a plain gender string
+    """
+    if reference_files is not None:
+        if speaker in reference_files:
+            logger.info(f"Using voice cloning for Speaker {speaker_id+1} with reference file: {os.path.basename(reference_files[speaker])}")
+            return {
+                'engine': 'xtts',
+                'reference_audio': reference_files[speaker],
+                'language': target_language  # Use the validated target language
+            }
+        
+        # Fallback to Edge TTS if no reference audio
+        logger.warning(f"No reference audio found for Speaker {speaker_id+1}, falling back to Edge TTS")
+        gender = "female"  # Default fallback
+        if str(speaker_id) in speaker_genders and speaker_genders[str(speaker_id)]:
+            gender = speaker_genders[str(speaker_id)]
+        return {'engine': 'edge_tts', 'gender': gender}
+    
+    # Standard Edge TTS configuration
+    gender = "female" if speaker_id % 2 == 0 else "male"  # Default fallback
+    
+    # Use selected gender if available
+    if str(speaker_id) in speaker_genders and speaker_genders[str(speaker_id)]:
+        gender = speaker_genders[str(speaker_id)]
+    return gender
 
 def create_session_id():
     """Create a unique session ID for tracking progress"""
@@ -53,9 +212,12 @@ def reset_application():
     import os
     import shutil
     import time
+    global _DIRS_READY
     
     # Directories to completely clean
-    directories_to_clean = ["temp", "audio", "audio2", "reference_audio", "outputs"]
+    directories_to_clean = list(WORK_DIRS)
+    # Directories may be recreated below; check them again on the next request
+    _DIRS_READY = False
     
     try:
         # First attempt - delete individual files
@@ -110,10 +272,6 @@ def reset_application():
                 except Exception as e:
                     logger.warning(f"Failed to delete root file {filename}: {e}")
                         
-        # Reset the global processing status
-        global processing_status
-        processing_status = {}
-        
         # Generate a new session ID
         new_session_id = create_session_id()
         
@@ -142,186 +300,249 @@ def reset_application():
             "message": ""
         }
 
-def process_video(media_source, target_language, tts_choice, max_speakers, speaker_genders, session_id, translation_method="batch", progress=gr.Progress()):
-    """Main processing function that handles the complete pipeline"""
-    global processing_status
-    processing_status[session_id] = {"status": "Starting", "progress": 0}
+def process_video(media_source, target_language, tts_choice, max_speakers, speaker_genders, session_id, translation_method="batch", force_refresh=False, asr_batch_size=None, progress=gr.Progress()):
+    """
+    Main processing function that handles the complete pipeline
+    
+    Yields a result dict at every stage so the UI can show progress as it
+    happens; the last dict carries the downloadable video and subtitle paths.
+    """
+    progress(0, desc="Starting")
+    _load_env()
+    _ensure_dirs()
+    device = acquire_device()
+    
+    # Every run works in its own subdirectories so concurrent runs never
+    # overwrite each other's downloads, stems, segments or subtitles; both are
+    # removed when the run ends. The results in outputs/ are named by run too:
+    # the session id comes from one gr.State shared by every browser tab
+    run_id = create_session_id()
+    work_dir = os.path.join("temp", run_id)
+    scratch_dir = _scratch_dir(run_id, work_dir)
+    
+    # Outputs that are ready before the end of the run (the subtitle file)
+    ready = {"subtitle": None}
+    
+    # Every job the run hands to the executor, settled before the run's device
+    # and directories are released (see finally)
+    background = []
+    
+    def submit(fn, *args, **kwargs):
+        """Run fn on the shared executor as part of this run"""
+        future = _EXECUTOR.submit(fn, *args, **kwargs)
+        background.append(future)
+        return future
+    
+    def stage(value, desc):
+        """Report a pipeline stage and build the intermediate result to yield"""
+        # Called on the request's own thread: gr.Progress finds its event
+        # through context variables, so calls from other threads are dropped
+        progress(value, desc=desc)
+        return {"error": False, "video": None, "subtitle": ready["subtitle"], "message": desc}
     
     try:
         # Get API tokens
         hf_token = os.getenv("HUGGINGFACE_TOKEN")
         
         if not hf_token:
-            return {"error": True, "message": "Error: HUGGINGFACE_TOKEN not found in .env file"}
+            yield {"error": True, "message": "Error: HUGGINGFACE_TOKEN not found in .env file"}
+            return
         
         # Determine if input is URL or file
         is_url = media_source.startswith(("http://", "https://"))
         
         # Initialize components
-        progress(0.05, desc="Initializing components")
-        processing_status[session_id] = {"status": "Initializing components", "progress": 0.05}
-        
-        ingester = MediaIngester(output_dir="temp")
-        recognizer = SpeechRecognizer(model_size="base")
-        diarizer = SpeakerDiarizer(hf_token=hf_token)
-        
-        # Step 1: Process input and extract audio
-        progress(0.1, desc="Processing media source")
-        processing_status[session_id] = {"status": "Processing media source", "progress": 0.1}
-        
-        video_path = ingester.process_input(media_source)
-        audio_path = ingester.extract_audio(video_path)
+        yield stage(0.05, "Initializing components")
         
-        progress(0.15, desc="Separating audio sources")
-        processing_status[session_id] = {"status": "Separating audio sources", "progress": 0.15}
+        logger.info(f"Running on {device}")
         
-        clean_audio_path, bg_audio_path = ingester.separate_audio_sources(audio_path)
+        ingester = MediaIngester(output_dir=work_dir, device=device)
+        use_voice_cloning = tts_choice == "Voice cloning (XTTS)"
         
-        # Step 2: Perform speech recognition
-        progress(0.2, desc="Transcribing audio")
-        processing_status[session_id] = {"status": "Transcribing audio", "progress": 0.2}
+        # Load (or fetch the warm) models in the background while the media is
+        # downloaded and separated; XTTS too when it will be needed
+        models_future = submit(
+            lambda: (get_recognizer(model_size="base", device=device), get_diarizer(hf_token, device=device))
+        )
+        if use_voice_cloning:
+            submit(XTTSModelLoader.get_model, device)
         
-        segments = recognizer.transcribe(clean_audio_path)
+        # Step 1: Process input and extract audio
+        yield stage(0.1, "Processing media source")
         
-        # Step 3: Perform speaker diarization
-        progress(0.3, desc="Identifying speakers")
-        processing_status[session_id] = {"status": "Identifying speakers", "progress": 0.3}
+        video_path = ingester.process_input(media_source)
+        file_basename = Path(video_path).stem  # Names the subtitle and output files
+        
+        # Intermediate results are cached by the media's content hash
+        media_key = pipeline_cache.file_digest(video_path)
+        
+        # Decode the audio once and split voice/background in memory
+        yield stage(0.15, "Extracting and separating audio sources")
+        
+        def separate():
+            voice_path, music_path, speech = ingester.extract_and_separate(video_path, speech_sample_rate=16000)
+            speech_path = os.path.join(os.path.dirname(voice_path), "speech.npy")
+            np.save(speech_path, speech)
+            return {"voice": voice_path, "music": music_path, "speech": speech_path}
+        
+        # The stems don't depend on the language or TTS settings, so reruns of
+        # the same media link them from the cache instead of separating again
+        stems = pipeline_cache.cached_links(
+            f"{media_key}:stems:htdemucs:{separation_overlap()}:{device.split(':')[0]}",
+            separate,
+            os.path.join(work_dir, "separated"),
+            force_refresh
+        )
+        clean_audio_path, bg_audio_path = stems["voice"], stems["music"]
+        speech = np.load(stems["speech"])
+        speech_input = {"waveform": torch.from_numpy(speech)[None], "sample_rate": 16000}
+        recognizer, diarizer = models_future.result()
         
         # Convert max_speakers to int or None
         max_speakers_val = int(max_speakers) if max_speakers and max_speakers.strip() else None
         
-        # Diarize audio to identify speakers
-        speakers = diarizer.diarize(clean_audio_path, max_speakers=max_speakers_val)
-        
-        # Step 4: Assign speakers to segments
-        progress(0.4, desc="Assigning speakers to segments")
-        processing_status[session_id] = {"status": "Assigning speakers to segments", "progress": 0.4}
-        
-        final_segments = diarizer.assign_speakers_to_segments(segments, speakers)
-        
-        # Step 5: Translate the segments
-        progress(0.5, desc=f"Translating to {target_language}")
-        processing_status[session_id] = {"status": f"Translating to {target_language}", "progress": 0.5}
-        
         # Validate target language
         valid_languages = ["en", "es", "fr", "de", "it", "ja", "ko", "pt", "ru", "zh", "hi"]
         if target_language not in valid_languages:
             logger.warning(f"Unsupported language: {target_language}, falling back to English")
             target_language = "en"
         
-        translated_segments = translate_text(
-            final_segments, 
-            target_lang=target_language,
-            translation_method=translation_method
-        )
+        def identify_speakers():
+            """Diarize, then cut each speaker's reference clip when voice cloning"""
+            speakers = pipeline_cache.cached(
+                f"{media_key}:diarize:{diarizer.model_name}:{max_speakers_val}",
+                lambda: diarizer.diarize(speech_input, max_speakers=max_speakers_val),
+                force_refresh
+            )
+            reference_files = None
+            if use_voice_cloning:
+                # Extract reference audio for voice cloning
+                logger.info("Extracting speaker reference audio for voice cloning...")
+                reference_dir = os.path.join(scratch_dir, "reference_audio")
+                reference_files = pipeline_cache.cached_files(
+                    f"{media_key}:refs:{diarizer.model_name}:{max_speakers_val}",
+                    lambda: diarizer.extract_speaker_references(clean_audio_path, speakers, output_dir=reference_dir),
+                    reference_dir,
+                    force_refresh
+                )
+            return speakers, reference_files
+        
+        # Diarization (plus reference extraction) only needs the separated voice,
+        # so it runs in the background while Whisper transcribes
+        speakers_started = time.monotonic()
+        speakers_future = submit(identify_speakers)
+        speakers_future.add_done_callback(lambda future: logger.info(
+            f"Speaker identification "
+            f"{'cancelled' if future.cancelled() else 'failed' if future.exception() else 'finished'} "
+            f"after {time.monotonic() - speakers_started:.1f}s"
+        ))
         
-        # Generate subtitle file
-        subtitle_file = f"temp/{os.path.basename(video_path).split('.')[0]}_{target_language}.srt"
-        generate_srt_subtitles(translated_segments, output_file=subtitle_file)
+        # Step 2: Perform speech recognition
+        yield stage(0.2, "Transcribing audio and identifying speakers")
         
-        # Step 6: Configure voice characteristics for speakers
-        progress(0.6, desc="Configuring voices")
-        processing_status[session_id] = {"status": "Configuring voices", "progress": 0.6}
+        segments = pipeline_cache.cached(
+            f"{media_key}:asr:{recognizer.model_size}:{recognizer.compute_type}",
+            lambda: recognizer.transcribe(speech, batch_size=asr_batch_size),
+            force_refresh=force_refresh
+        )
         
-        # Detect number of unique speakers
-        unique_speakers = set()
-        for segment in translated_segments:
-            if 'speaker' in segment:
-                unique_speakers.add(segment['speaker'])
+        # Step 3: Translation only needs the transcript text, so it overlaps
+        # with whatever is left of diarization
+        yield stage(0.3, f"Translating to {target_language}")
         
-        logger.info(f"Detected {len(unique_speakers)} speakers")
+        translated_segments = pipeline_cache.cached(
+            f"{media_key}:asr:{recognizer.model_size}:{recognizer.compute_type}:translate:{translation_method}:{target_language}",
+            lambda: translate_text(segments, target_lang=target_language, translation_method=translation_method),
+            force_refresh
+        )
+        if not speakers_future.done():
+            yield stage(0.4, "Waiting for speaker identification")
+        speakers, reference_files = speakers_future.result()
         
-        # Use provided speaker genders
-        use_voice_cloning = tts_choice == "Voice cloning (XTTS)"
-        voice_config = {}  # Map of speaker_id to gender or voice config
+        # Step 4: Assign speakers to the translated segments
+        yield stage(0.5, "Assigning speakers to segments")
         
-        if use_voice_cloning:
-            # Extract reference audio for voice cloning
-            logger.info("Extracting speaker reference audio for voice cloning...")
-            reference_files = diarizer.extract_speaker_references(
-                clean_audio_path, 
-                speakers, 
-                output_dir="reference_audio"
-            )
-            
-            # Create voice config for XTTS
-            for speaker in sorted(list(unique_speakers)):
-                match = re.search(r'SPEAKER_(\d+)', speaker)
-                if match:
-                    speaker_id = int(match.group(1))
-                    if speaker in reference_files:
-                        voice_config[speaker_id] = {
-                            'engine': 'xtts',
-                            'reference_audio': reference_files[speaker],
-                            'language': target_language  # Use the validated target language
-                        }
-                        logger.info(f"Using voice cloning for Speaker {speaker_id+1} with reference file: {os.path.basename(reference_files[speaker])}")
-                    else:
-                        # Fallback to Edge TTS if no reference audio
-                        logger.warning(f"No reference audio found for Speaker {speaker_id+1}, falling back to Edge TTS")
-                        gender = "female"  # Default fallback
-                        if str(speaker_id) in speaker_genders and speaker_genders[str(speaker_id)]:
-                            gender = speaker_genders[str(speaker_id)]
-                        
-                        voice_config[speaker_id] = {
-                            'engine': 'edge_tts',
-                            'gender': gender
-                        }
-        else:
-            # Standard Edge TTS configuration
-            if len(unique_speakers) > 0:
-                for speaker in sorted(list(unique_speakers)):
-                    match = re.search(r'SPEAKER_(\d+)', speaker)
-                    if match:
-                        speaker_id = int(match.group(1))
-                        gender = "female" if speaker_id % 2 == 0 else "male"  # Default fallback
-                        
-                        # Use selected gender if available
-                        if str(speaker_id) in speaker_genders and speaker_genders[str(speaker_id)]:
-                            gender = speaker_genders[str(speaker_id)]
-                            
-                        voice_config[speaker_id] = gender
+        translated_segments = diarizer.assign_speakers_to_segments(translated_segments, speakers)
         
-        # Step 7: Generate speech in target language
-        progress(0.7, desc=f"Generating speech in {target_language}")
-        processing_status[session_id] = {"status": f"Generating speech in {target_language}", "progress": 0.7}
+        # Subtitles only need the translation, so hand them to the user now
+        # rather than after dubbing
+        downloadable_subtitle = f"outputs/{file_basename}_{target_language}_{run_id}.srt"
+        generate_srt_subtitles(translated_segments, output_file=downloadable_subtitle)
+        ready["subtitle"] = downloadable_subtitle
+        yield stage(0.55, "Subtitles ready")
         
-        dubbed_audio_path = generate_tts(translated_segments, target_language, voice_config, output_dir="audio2")
+        # Step 5: Configure voice characteristics for speakers
+        yield stage(0.6, "Configuring voices")
         
-        # Step 8: Create video with mixed audio
-        progress(0.85, desc="Creating final video")
-        processing_status[session_id] = {"status": "Creating final video", "progress": 0.85}
+        # Build the map of speaker_id to gender or voice config in one pass
+        voice_config = {}
+        seen = set()
+        for segment in translated_segments:
+            speaker = segment.get('speaker')
+            if not speaker or speaker in seen:
+                continue
+            seen.add(speaker)
+            speaker_id = parse_speaker_id(speaker)
+            if speaker_id is None or speaker_id in voice_config:
+                continue
+            voice_config[speaker_id] = _make_voice_cfg(
+                speaker_id, speaker, reference_files, speaker_genders, target_language
+            )
         
+        logger.info(f"Detected {len(voice_config)} speakers")
+        
+        # Step 6: Generate speech in target language
+        yield stage(0.7, f"Generating speech in {target_language}")
+        
+        # Segments finish on worker threads, so synthesis runs on the executor
+        # and this thread relays the latest count to the progress bar
+        tts_updates = queue.Queue()
+        tts_future = submit(
+            generate_tts,
+            translated_segments, target_language, voice_config,
+            output_dir=os.path.join(scratch_dir, "audio2"),
+            segment_dir=os.path.join(scratch_dir, "audio"),
+            use_cache=not force_refresh,
+            progress_callback=lambda done, total: tts_updates.put((done, total)),
+            device=device
+        )
+        while not tts_future.done() or not tts_updates.empty():
+            try:
+                update = tts_updates.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            # Collapse a burst of finished segments into one update
+            while not tts_updates.empty():
+                update = tts_updates.get_nowait()
+            done, total = update
+            yield stage(0.7 + 0.15 * done / total, f"Generating speech in {target_language} ({done}/{total} segments)")
+        dubbed_audio_path = tts_future.result()
+        
+        # Step 7: Create video with mixed audio
+        yield stage(0.85, "Creating final video")
+        
+        # ffmpeg writes the final video straight to its downloadable name
+        downloadable_video = f"outputs/{file_basename}_{target_language}_{run_id}.mp4"
         success = create_video_with_mixed_audio(
             main_video_path=video_path, 
             background_music_path=bg_audio_path, 
-            main_audio_path=dubbed_audio_path
+            main_audio_path=dubbed_audio_path,
+            temp_dir=work_dir,
+            output_path=downloadable_video,
+            video_codec="copy"  # Only the audio changes; remux the video stream
         )
         
         if not success:
             raise RuntimeError("Failed to create final video with audio")
         
-        # Use known output path since function returns boolean
-        output_video_path = os.path.join("temp", "output_video.mp4")
-        
         # Verify the output video exists
-        if not os.path.exists(output_video_path):
-            raise FileNotFoundError(f"Output video not found at expected path: {output_video_path}")
-        
-        # Create downloadable copies with unique names
-        file_basename = os.path.basename(video_path).split('.')[0]
-        downloadable_video = f"outputs/{file_basename}_{target_language}_{session_id}.mp4"
-        downloadable_subtitle = f"outputs/{file_basename}_{target_language}_{session_id}.srt"
-        
-        # Copy files to outputs directory for download
-        shutil.copy2(output_video_path, downloadable_video)
-        shutil.copy2(subtitle_file, downloadable_subtitle)
+        if not os.path.exists(downloadable_video):
+            raise FileNotFoundError(f"Output video not found at expected path: {downloadable_video}")
             
         # Complete
-        progress(1.0, desc="Process completed")
-        processing_status[session_id] = {"status": "Completed", "progress": 1.0}
+        progress(1.0, desc="Completed")
         
-        return {
+        yield {
             "error": False,
             "video": downloadable_video,
             "subtitle": downloadable_subtitle,
@@ -330,15 +551,19 @@ def process_video(media_source, target_language, tts_choice, max_speakers, speak
         
     except Exception as e:
         logger.exception("Error in processing pipeline")
-        processing_status[session_id] = {"status": f"Error: {str(e)}", "progress": -1}
-        return {"error": True, "message": f"Error: {str(e)}"}
-
-def get_processing_status(session_id):
-    """Get the current processing status for the given session"""
-    global processing_status
-    if session_id in processing_status:
-        return processing_status[session_id]["status"]
-    return "No status available"
+        yield {"error": True, "message": f"Error: {str(e)}"}
+    finally:
+        # An error or a closed client lands here with background jobs possibly
+        # still running: drop the ones that haven't started and wait for the
+        # rest, so none of them shares the pooled models with the device's next
+        # run or writes into directories that are being deleted
+        for future in background:
+            future.cancel()
+        wait(background)
+        release_device(device)
+        if os.path.dirname(scratch_dir) != work_dir:
+            _discard(scratch_dir)
+        _discard(work_dir)
 
 def check_api_tokens():
     """Check if required API tokens are set"""
@@ -359,7 +584,7 @@ def check_system_state():
     import os
     
     # Directories to check
-    directories_to_check = ["temp", "audio", "audio2", "reference_audio", "outputs"]
+    directories_to_check = list(WORK_DIRS)
     report = []
     
     for directory in directories_to_check:
@@ -383,6 +608,7 @@ def check_system_state():
 
 # Define the Gradio interface
 def create_interface():
+    _load_env()
     with gr.Blocks(title="SyncDub - Video Translation and Dubbing") as app:
         gr.Markdown("# SyncDub - Video Translation and Dubbing")
         gr.Markdown("Translate and dub videos to different languages with speaker diarization")
@@ -445,6 +671,21 @@ def create_interface():
                             value="batch",
                             info="Batch: Faster for longer content. Iterative: May be more accurate for short content. Groq: Uses Groq LLM API."
                         )
+                        force_refresh = gr.Checkbox(
+                            label="Force refresh",
+                            value=False,
+                            info="Ignore cached transcripts, speakers and translations for this video."
+                        )
+                    
+                    with gr.Accordion("Advanced", open=False):
+                        asr_batch_size = gr.Slider(
+                            minimum=1,
+                            maximum=32,
+                            value=int(os.getenv("WHISPER_BATCH_SIZE", "16")),
+                            step=1,
+                            label="Transcription batch size",
+                            info="Audio chunks transcribed together. Lower it if the GPU runs out of memory."
+                        )
                     
                     # Speaker count input and update button
                     with gr.Row():
@@ -507,30 +748,37 @@ def create_interface():
             )
             
             # Function to actually pass the gender values to the process_video function
-            def process_with_genders(input_type_val, url_val, upload_val, target_language, tts_choice, max_speakers, translation_method, session_id, *gender_values):
+            # progress sits before *gender_values so Gradio recognizes it and
+            # inserts the tracker there. track_tqdm also forwards tqdm bars
+            # created on the request thread, i.e. Whisper's transcription
+            # progress; stages running on the executor aren't tracked
+            def process_with_genders(input_type_val, url_val, upload_val, target_language, tts_choice, max_speakers, translation_method, force_refresh, asr_batch_size, session_id, progress=gr.Progress(track_tqdm=True), *gender_values):
                 # Determine the actual media source based on the input type
                 if input_type_val == "URL":
                     media_source = url_val
                 elif input_type_val == "Upload":
                     media_source = upload_val # This will be the file path from gr.Video
                 else:
-                    return None, None, "Invalid input type selected."
+                    yield None, None, "Invalid input type selected."
+                    return
 
                 if not media_source:
-                     return None, None, "Please provide a video URL or upload a file."
+                    yield None, None, "Please provide a video URL or upload a file."
+                    return
 
                 # Convert the gender values into a dictionary to pass to process_video
                 speaker_genders_dict = {str(i): gender for i, gender in enumerate(gender_values) if gender}
                 
-                # Call the main processing function
-                result = process_video(media_source, target_language, tts_choice, max_speakers, 
-                                      speaker_genders_dict, session_id, translation_method=translation_method)
-                
-                # Return the output values based on whether there was an error
-                if result.get("error", False):
-                    return None, None, result.get("message", "An error occurred")
-                else:
-                    return result.get("video"), result.get("subtitle"), result.get("message")
+                # Run the pipeline, streaming each stage to the UI
+                for result in process_video(media_source, target_language, tts_choice, max_speakers, 
+                                            speaker_genders_dict, session_id, translation_method=translation_method,
+                                            force_refresh=force_refresh, asr_batch_size=int(asr_batch_size),
+                                            progress=progress):
+                    # Yield the output values based on whether there was an error
+                    if result.get("error", False):
+                        yield None, None, result.get("message", "An error occurred")
+                        return
+                    yield result.get("video"), result.get("subtitle"), result.get("message")
             
             # Connect the process button
             process_btn.click(
@@ -543,24 +791,19 @@ def create_interface():
                     tts_choice, 
                     max_speakers,
                     translation_method,
+                    force_refresh,
+                    asr_batch_size,
                     session_id_state,   # Pass the session ID state
                     # Pass individual radio components for genders
                     *[speaker_genders[str(i)] for i in range(8)]
                 ],
-                outputs=[output, subtitle_output, output_message]
+                outputs=[output, subtitle_output, output_message],
+                queue=True,
+                show_progress="full",  # Stage updates stream over the queue's connection
+                # One pipeline per leasable device (see acquire_device)
+                concurrency_limit=torch.cuda.device_count() or 1
             )
             
-            # Update status periodically using the session ID from state
-            status_timer = gr.Timer(2, lambda s_id: get_processing_status(s_id), session_id_state, status_text)
-            
-            # Create a more compatible approach for status updates
-            # ... (start_status_updates function remains the same) ...
-            
-            # Status checking function
-            def check_status(s_id):
-                status = get_processing_status(s_id)
-                return status
-            
             # Define the handle_reset function here
             def handle_reset():
                 """Handle the reset button click by calling reset_application()"""
@@ -587,17 +830,10 @@ def create_interface():
                         None, None, None, None, "", gr.State() # No change to session ID state
                     )
             
-            # Replace multiple button rows with a single row containing both buttons
+            # Progress streams into the progress bar and output message while a
+            # run is active, so no status refresh button is needed
             with gr.Row():
                 reset_btn = gr.Button("🗑️ Reset Everything", variant="stop")
-                refresh_btn = gr.Button("Refresh Status")
-            
-            # Connect the refresh button to check status
-            refresh_btn.click(
-                fn=check_status,
-                inputs=[session_id_state], # Use session ID from state
-                outputs=[status_text]
-            )
             
             # Now use the defined handle_reset function
             reset_btn.click(
@@ -614,42 +850,6 @@ def create_interface():
                 ]
             )
             
-            # Create a simple auto-refresh component using JavaScript
-            gr.HTML("""
-            <script>
-            // Simple poller to update status
-            document.addEventListener('DOMContentLoaded', function() {
-                let refreshInterval;
-                
-                // Look for the primary button (Process Video)
-                const processButton = document.querySelector('button.primary');
-                
-                if (processButton) {
-                    // When process starts, begin polling
-                    processButton.addEventListener('click', function() {
-                        if (refreshInterval) clearInterval(refreshInterval);
-                        
-                        // Find the refresh button
-                        const refreshButtons = Array.from(document.querySelectorAll('button'));
-                        const refreshButton = refreshButtons.find(btn => btn.textContent.includes('Refresh Status'));
-                        
-                        if (refreshButton) {
-                            // Start auto-polling every 2 seconds
-                            refreshInterval = setInterval(function() {
-                                refreshButton.click();
-                            }, 2000);
-                            
-                            // Stop polling after 30 minutes (safety)
-                            setTimeout(function() {
-                                if (refreshInterval) clearInterval(refreshInterval);
-                            }, 30*60*1000);
-                        }
-                    });
-                }
-            });
-            </script>
-            """)
-            
             # Add a debug button to the interface
             with gr.Row():
                 check_btn = gr.Button("Check System State", variant="secondary")
@@ -685,6 +885,38 @@ def create_interface():
     return app
 
 # Launch the interface
+def _warmup():
+    """
+    Load the pooled models on every device and run them once on a second of
+    silence, so CUDA context creation, kernel selection and JIT compilation
+    happen at startup instead of on the first user's request
+    """
+    _load_env()
+    hf_token = os.getenv("HUGGINGFACE_TOKEN")
+    silence = np.zeros(16000, dtype=np.float32)
+    
+    try:
+        compile_kernels()
+    except Exception as e:
+        logger.warning(f"Compiling speaker assignment kernel failed: {e}")
+    
+    for device in list(_device_queue().queue):
+        logger.info(f"Warming up models on {device}...")
+        try:
+            if device.startswith("cuda"):
+                torch.zeros(1, device=device)
+            
+            get_demucs_model(device=torch.device(device))
+            get_recognizer(model_size="base", device=device).transcribe(silence)
+            
+            if hf_token:
+                diarizer = get_diarizer(hf_token, device=device)
+                diarizer.diarize({"waveform": torch.from_numpy(silence)[None], "sample_rate": 16000})
+        except Exception as e:
+            logger.warning(f"Warmup on {device} failed: {e}")
+
 if __name__ == "__main__":
+    _EXECUTOR.submit(_empty_trash)
+    _warmup()
     app = create_interface()
-    app.launch(share=True)
+    app.queue(default_concurrency_limit=1, max_size=32).launch(share=True)
@@ -1,12 +1,59 @@
 import yt_dlp
 import os
+import logging
+import numpy as np
+import soundfile as sf
 from moviepy.editor import VideoFileClip
 import subprocess
 import shutil
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Demucs models are loaded once per process (and device) and shared by all ingesters
+_DEMUCS_MODELS = {}
+_DEMUCS_LOCK = threading.Lock()
+
+def high_precision():
+    """Whether reduced-precision inference is disabled (SYNCDUB_HIGH_PRECISION=1)"""
+    return os.getenv("SYNCDUB_HIGH_PRECISION", "0") == "1"
+
+def separation_overlap():
+    """
+    Overlap between Demucs' inference windows: 0.1 instead of the CLI's 0.25
+    cuts about 15% of the separation work, unless SYNCDUB_HIGH_PRECISION=1
+    """
+    return 0.25 if high_precision() else 0.1
+
+def get_demucs_model(name="htdemucs", device=None):
+    """
+    Get (or load) a pretrained Demucs model for the given device
+    
+    On CPU the model's linear layers are quantized to int8 unless
+    SYNCDUB_HIGH_PRECISION=1; on GPU reduced precision is applied at
+    inference time through autocast instead.
+    """
+    key = (name, str(device))
+    with _DEMUCS_LOCK:
+        if key not in _DEMUCS_MODELS:
+            _DEMUCS_MODELS[key] = _load_demucs_model(name, device)
+        return _DEMUCS_MODELS[key]
+
+def _load_demucs_model(name, device):
+    """Load a pretrained Demucs model, quantized for CPU unless high precision is requested"""
+    import torch
+    from demucs.pretrained import get_model
+    model = get_model(name)
+    model.eval()
+    if device is not None and torch.device(device).type == "cpu" and not high_precision():
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
 
 class MediaIngester:
-    def __init__(self, output_dir="temp"):
+    def __init__(self, output_dir="temp", device=None):
         self.output_dir = output_dir
+        self.device = device  # Device for source separation (defaults to cuda when available)
         os.makedirs(output_dir, exist_ok=True)
         
     def process_input(self, source):
@@ -42,6 +89,125 @@ class MediaIngester:
         # For simplicity, just return the path if it's a valid file
         return file_path
         
+    def decode_audio(self, media_path, sample_rate=44100, channels=2):
+        """
+        Decode the audio track of a media file with a single ffmpeg call
+        
+        Returns:
+            tuple: (float32 array of shape (channels, samples), sample_rate)
+        """
+        cmd = [
+            "ffmpeg", "-nostdin", "-loglevel", "error",
+            "-i", media_path,
+            "-vn", "-f", "f32le", "-acodec", "pcm_f32le",
+            "-ac", str(channels), "-ar", str(sample_rate),
+            "pipe:1"
+        ]
+        process = subprocess.run(cmd, capture_output=True, check=True)
+        audio = np.frombuffer(process.stdout, dtype=np.float32).reshape(-1, channels)
+        return np.ascontiguousarray(audio.T), sample_rate
+    
+    def extract_and_separate(self, video_path, speech_sample_rate=None, chunk_seconds=60, context_seconds=5):
+        """
+        Decode the video's audio once and split it into voice and background
+        stems in memory, without writing an intermediate extracted WAV.
+        
+        The audio is separated chunk by chunk and the stems are appended to
+        their WAV files as they are produced, so only one chunk's stems are held
+        in memory at a time. Each chunk is separated with extra context on both
+        sides that is then discarded, so chunk boundaries leave no seams.
+        
+        Falls back to extract_audio + separate_audio_sources if the in-memory
+        path fails.
+        
+        Parameters:
+            video_path (str): Path to the input video (or audio) file
+            speech_sample_rate (int): If set, also return the voice stem as a mono
+                float32 array at this rate, ready for Whisper and diarization
+            chunk_seconds (float): Length of audio separated per chunk
+            context_seconds (float): Context added on each side of a chunk
+            
+        Returns:
+            tuple: (voice_audio_path, background_music_path), plus the voice
+            array when speech_sample_rate is set
+        """
+        separation_dir = os.path.join(self.output_dir, "separated")
+        os.makedirs(separation_dir, exist_ok=True)
+        voice_path = os.path.join(separation_dir, "voice.wav")
+        music_path = os.path.join(separation_dir, "music.wav")
+        
+        try:
+            import torch
+            import torchaudio
+            from demucs.apply import apply_model
+            
+            device = torch.device(self.device or ("cuda" if torch.cuda.is_available() else "cpu"))
+            model = get_demucs_model(device=device)
+            audio, sr = self.decode_audio(video_path, sample_rate=model.samplerate, channels=model.audio_channels)
+            
+            print(f"Separating audio sources from {os.path.basename(video_path)}...")
+            wav = torch.from_numpy(audio)
+            
+            # Normalize the input the same way the Demucs CLI does (over the whole track)
+            ref = wav.mean(0)
+            mean, std = ref.mean(), ref.std() + 1e-8
+            # fp16 convolutions on GPU; the STFT stays in fp32 under autocast
+            use_fp16 = device.type == "cuda" and not high_precision()
+            vocals_index = model.sources.index("vocals")
+            
+            total = wav.shape[-1]
+            chunk = int(chunk_seconds * sr)
+            context = int(context_seconds * sr)
+            speech_chunks = []
+            
+            # Stems are written as 16-bit WAVs (half the size of float ones; they
+            # are only mixed and resampled afterwards). Without the whole track
+            # in memory there is no global peak to rescale by, so the rare
+            # sample past full scale is clipped instead
+            with sf.SoundFile(voice_path, "w", sr, model.audio_channels, subtype="PCM_16") as voice_file, \
+                 sf.SoundFile(music_path, "w", sr, model.audio_channels, subtype="PCM_16") as music_file:
+                for start in range(0, total, chunk):
+                    end = min(start + chunk, total)
+                    lo, hi = max(0, start - context), min(total, end + context)
+                    
+                    with torch.inference_mode(), torch.autocast("cuda", dtype=torch.float16, enabled=use_fp16):
+                        sources = apply_model(
+                            model, ((wav[:, lo:hi] - mean) / std)[None], device=device,
+                            shifts=0, split=True, overlap=separation_overlap(), progress=False
+                        )[0]
+                    sources = sources.float() * std + mean
+                    
+                    # Two-stem split: vocals vs. everything else
+                    vocals = sources[vocals_index]
+                    background = sources.sum(dim=0) - vocals
+                    voice_file.write(np.clip(vocals[:, start - lo:end - lo].cpu().numpy().T, -1.0, 1.0))
+                    music_file.write(np.clip(background[:, start - lo:end - lo].cpu().numpy().T, -1.0, 1.0))
+                    
+                    if speech_sample_rate:
+                        # Resample with the context too, then keep this chunk's span
+                        speech = torchaudio.functional.resample(vocals.mean(dim=0), sr, speech_sample_rate)
+                        first = round((start - lo) * speech_sample_rate / sr)
+                        last = round((end - lo) * speech_sample_rate / sr)
+                        speech_chunks.append(speech[first:last].numpy().astype(np.float32))
+                    
+                    del sources, vocals, background
+            print("Separation complete.")
+            
+            if not speech_sample_rate:
+                return voice_path, music_path
+            
+            # Hand the voice stem on in memory instead of re-reading voice.wav
+            return voice_path, music_path, np.concatenate(speech_chunks)
+        
+        except Exception as e:
+            print(f"In-memory separation failed ({e}), falling back to file-based separation")
+            audio_path = self.extract_audio(video_path)
+            voice_path, music_path = self.separate_audio_sources(audio_path)
+            if not speech_sample_rate:
+                return voice_path, music_path
+            speech, _ = self.decode_audio(voice_path, sample_rate=speech_sample_rate, channels=1)
+            return voice_path, music_path, speech[0]
+    
     def extract_audio(self, video_path):
         """Extract audio from video file"""
         audio_path = os.path.join(self.output_dir, "extracted_audio.wav")
@@ -73,6 +239,7 @@ class MediaIngester:
             # Method 1: Using Demucs as a command-line tool
             cmd = [
                 "demucs", "--two-stems=vocals",
+                "--overlap", str(separation_overlap()),
                 "-o", separation_dir,
                 audio_path
             ]
@@ -98,7 +265,7 @@ class MediaIngester:
             print("Separation complete.")
             
             # Demucs creates a subdirectory with model name and then the base name
-            base_name = os.path.splitext(os.path.basename(audio_path))[0]
+            base_name = Path(audio_path).stem
             model_name = "htdemucs"  # default model
             demucs_output_dir = os.path.join(separation_dir, model_name, base_name)
             
@@ -106,9 +273,10 @@ class MediaIngester:
             actual_voice_path = os.path.join(demucs_output_dir, "vocals.wav") 
             actual_music_path = os.path.join(demucs_output_dir, "no_vocals.wav")
             
-            # Move files to their final locations
-            shutil.copy2(actual_voice_path, voice_path)
-            shutil.copy2(actual_music_path, music_path)
+            # Move files to their final locations (a rename: the model's
+            # directory is deleted right after, so there's nothing to copy for)
+            os.replace(actual_voice_path, voice_path)
+            os.replace(actual_music_path, music_path)
             
             # Clean up if needed
             shutil.rmtree(os.path.join(separation_dir, model_name))
@@ -0,0 +1,280 @@
+import os
+import mmap
+import pickle
+import shutil
+import hashlib
+import tempfile
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Intermediate results (transcripts, speaker turns, translations) keyed by the
+# media's content hash, so re-running the same video skips the expensive steps.
+# Kept outside the working directories so "Reset Everything" doesn't drop it.
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".syncdub", "cache")
+SIZE_LIMIT = 10 << 30  # 10 GiB
+
+_lock = threading.Lock()
+
+# Running estimate of the cache's size in bytes. The first write measures it
+# with a full scan, and later writes add to it, so the directory is only
+# rescanned (and evicted) once the estimate passes SIZE_LIMIT
+_total_size = None
+
+def file_digest(path, sample_size=4 << 20):
+    """
+    Fingerprint a media file from its size plus samples of its first, middle
+    and last bytes
+
+    Hashing a multi-GB video in full would take longer than some of the steps
+    being cached; container headers and the file size already distinguish
+    different media in practice. The samples are read through mmap, so only
+    the pages hashed are ever touched.
+
+    Args:
+        path: Path to the file
+        sample_size: Number of bytes hashed at each of the three positions
+
+    Returns:
+        Hex digest identifying the file's contents
+    """
+    size = os.path.getsize(path)
+    digest = hashlib.blake2b(str(size).encode("ascii"), digest_size=16)
+    with open(path, "rb") as f:
+        if size <= 3 * sample_size:
+            digest.update(f.read())
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                middle = size // 2
+                digest.update(m[:sample_size])
+                digest.update(m[middle:middle + sample_size])
+                digest.update(m[-sample_size:])
+    return digest.hexdigest()
+
+def cache_dir():
+    """Cache root (SYNCDUB_CACHE_DIR, read on use so a .env loaded later applies)"""
+    return os.getenv("SYNCDUB_CACHE_DIR") or DEFAULT_CACHE_DIR
+
+def _entry_path(key):
+    """Map a cache key to its file on disk"""
+    name = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+    return os.path.join(cache_dir(), f"{name}.pkl")
+
+def get(key, default=None):
+    """Return the cached value for key, or default if it isn't cached"""
+    path = _entry_path(key)
+    try:
+        with open(path, "rb") as f:
+            value = pickle.load(f)
+        # Refresh the entry's mtime so eviction drops the least recently used
+        os.utime(path)
+        return value
+    except FileNotFoundError:
+        return default
+    except Exception as e:
+        logger.warning(f"Discarding unreadable cache entry {path}: {e}")
+        return default
+
+def put(key, value):
+    """Store value under key, evicting the least recently used entries past SIZE_LIMIT"""
+    with _lock:
+        os.makedirs(cache_dir(), exist_ok=True)
+        path = _entry_path(key)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        _account(os.path.getsize(path))
+
+def _account(added):
+    """Add a write to the size estimate, evicting once it passes SIZE_LIMIT (call with _lock held)"""
+    global _total_size
+    if _total_size is None or _total_size + added > SIZE_LIMIT:
+        _evict()
+    else:
+        _total_size += added
+
+def _evict():
+    """
+    Delete the least recently used entries until the cache is back under 90%
+    of SIZE_LIMIT, leaving headroom so the next writes don't rescan right away
+    """
+    global _total_size
+    entries = []
+    total = 0
+    for entry in os.scandir(cache_dir()):
+        if entry.is_file() and entry.name.endswith(".pkl"):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+    # Directories of linked files (see cached_links) count as one entry each
+    links_root = os.path.join(cache_dir(), "files")
+    if os.path.isdir(links_root):
+        for entry in os.scandir(links_root):
+            if entry.is_dir() and not entry.name.endswith(".tmp"):
+                size = sum(f.stat().st_size for f in os.scandir(entry.path) if f.is_file())
+                entries.append((entry.stat().st_mtime, size, entry.path))
+                total += size
+
+    for _, size, path in sorted(entries):
+        if total <= SIZE_LIMIT * 9 // 10:
+            break
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            total -= size
+        except OSError:
+            pass
+    _total_size = total
+
+def cached(key, compute, force_refresh=False):
+    """
+    Return the cached value for key, computing and storing it on a miss
+
+    Args:
+        key: Cache key (should include every input that affects the result)
+        compute: Zero-argument callable producing the value
+        force_refresh: Ignore any cached value and recompute
+
+    Returns:
+        The cached or freshly computed value
+    """
+    if not force_refresh:
+        value = get(key)
+        if value is not None:
+            logger.info(f"Pipeline cache hit: {key}")
+            return value
+
+    value = compute()
+    # Empty results usually mean a step failed; don't pin them in the cache
+    if value:
+        put(key, value)
+    return value
+
+def cached_files(key, compute, output_dir, force_refresh=False):
+    """
+    Like cached(), for a step that writes files and returns a dict of their paths
+    
+    The files' contents are stored in the cache entry, and on a hit they are
+    written back into output_dir under their original names.
+    
+    Args:
+        key: Cache key (should include every input that affects the result)
+        compute: Zero-argument callable writing the files and returning {name: path}
+        output_dir: Directory the files are restored into on a hit
+        force_refresh: Ignore any cached value and recompute
+        
+    Returns:
+        Dictionary mapping each name to its file path
+    """
+    if not force_refresh:
+        entry = get(key)
+        if entry is not None:
+            logger.info(f"Pipeline cache hit: {key}")
+            os.makedirs(output_dir, exist_ok=True)
+            paths = {}
+            for name, (basename, data) in entry.items():
+                paths[name] = os.path.join(output_dir, basename)
+                with open(paths[name], "wb") as f:
+                    f.write(data)
+            return paths
+    
+    paths = compute()
+    if paths:
+        entry = {}
+        for name, path in paths.items():
+            with open(path, "rb") as f:
+                entry[name] = (os.path.basename(path), f.read())
+        put(key, entry)
+    return paths
+
+def _link(src, dst):
+    """Hardlink src to dst, copying instead when they are on different filesystems"""
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+def cached_links(key, compute, output_dir, force_refresh=False):
+    """
+    Like cached_files(), for large files that shouldn't be read into a pickle
+    
+    The files are kept as they are in a directory of the cache and hardlinked
+    into output_dir on a hit (copied when the cache is on another filesystem),
+    so a hit costs next to no I/O. On a miss they are hardlinked into the
+    cache, or copied in the background across filesystems. Callers must not
+    modify the files in place.
+    
+    Args:
+        key: Cache key (should include every input that affects the result)
+        compute: Zero-argument callable writing the files and returning {name: path}
+        output_dir: Directory the files are linked into on a hit
+        force_refresh: Ignore any cached files and recompute
+        
+    Returns:
+        Dictionary mapping each name to its file path
+    """
+    entry_dir = os.path.join(cache_dir(), "files", os.path.basename(_entry_path(key))[:-4])
+    
+    if not force_refresh:
+        entry = get(key)
+        if entry is not None and os.path.isdir(entry_dir):
+            logger.info(f"Pipeline cache hit: {key}")
+            os.makedirs(output_dir, exist_ok=True)
+            os.utime(entry_dir)
+            try:
+                paths = {}
+                for name, basename in entry.items():
+                    paths[name] = os.path.join(output_dir, basename)
+                    _link(os.path.join(entry_dir, basename), paths[name])
+                return paths
+            except OSError as e:
+                logger.warning(f"Discarding incomplete cache entry {entry_dir}: {e}")
+    
+    paths = compute()
+    if paths:
+        index = {name: os.path.basename(path) for name, path in paths.items()}
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(suffix=".tmp", dir=os.path.dirname(entry_dir))
+        try:
+            for path in paths.values():
+                os.link(path, os.path.join(tmp_dir, os.path.basename(path)))
+        except OSError:
+            # Another filesystem: copying would hold up the caller, so it
+            # happens in the background, from handles opened now because the
+            # caller may delete its files before the copy gets to them
+            sources = [open(path, "rb") for path in paths.values()]
+            threading.Thread(
+                target=_copy_entry, args=(key, index, sources, tmp_dir, entry_dir), daemon=True
+            ).start()
+        else:
+            _commit_entry(key, index, tmp_dir, entry_dir)
+    return paths
+
+def _commit_entry(key, index, tmp_dir, entry_dir):
+    """Move a filled temporary directory into place as the entry for key"""
+    with _lock:
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        _account(sum(f.stat().st_size for f in os.scandir(entry_dir)))
+    put(key, index)
+
+def _copy_entry(key, index, sources, tmp_dir, entry_dir):
+    """Copy open files into tmp_dir and commit it as the entry for key (runs in the background)"""
+    try:
+        for source in sources:
+            with open(os.path.join(tmp_dir, os.path.basename(source.name)), "wb") as f:
+                shutil.copyfileobj(source, f, 1 << 20)
+        _commit_entry(key, index, tmp_dir, entry_dir)
+    except Exception as e:
+        logger.warning(f"Could not cache files for {key}: {e}")
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    finally:
+        for source in sources:
+            source.close()
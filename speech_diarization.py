@@ -1,12 +1,166 @@
 from pyannote.audio import Pipeline
+import numpy as np
 import torch
 import os
 import time
 
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:
+    # numba is optional (it normally comes with librosa); without it speaker
+    # assignment uses the vectorized NumPy version below instead
+    HAVE_NUMBA = False
+    
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+@njit(cache=True)
+def _assign_turns(seg_starts, seg_ends, turn_starts, turn_ends, turn_order):
+    """
+    Pick the diarization turn for every transcript segment.
+    
+    Turns must be sorted by start time; turn_order holds their original
+    indices, which are returned. Each segment gets the turn with the largest
+    overlap (earliest original turn on ties) or, if none overlaps, the turn
+    whose start or end is nearest to the segment's midpoint.
+    """
+    n = seg_starts.shape[0]
+    m = turn_starts.shape[0]
+    
+    # Running maximum of turn ends, so the first turn that can still reach a
+    # segment is found by binary search even when turns overlap
+    max_end = np.empty(m)
+    running = -np.inf
+    for j in range(m):
+        running = max(running, turn_ends[j])
+        max_end[j] = running
+    
+    result = np.empty(n, dtype=np.int64)
+    for i in range(n):
+        start = seg_starts[i]
+        end = seg_ends[i]
+        lo = np.searchsorted(max_end, start, side="right")
+        hi = np.searchsorted(turn_starts, end, side="left")
+        
+        best = -1
+        best_overlap = 0.0
+        for j in range(lo, hi):
+            if turn_ends[j] > start:
+                overlap = min(turn_ends[j], end) - max(turn_starts[j], start)
+                if best == -1 or overlap > best_overlap or (overlap == best_overlap and turn_order[j] < best):
+                    best = turn_order[j]
+                    best_overlap = overlap
+        
+        if best == -1:
+            # No overlap: fall back to the nearest turn boundary
+            mid = (start + end) / 2
+            best_distance = 0.0
+            for j in range(m):
+                distance = min(abs(turn_starts[j] - mid), abs(turn_ends[j] - mid))
+                if best == -1 or distance < best_distance or (distance == best_distance and turn_order[j] < best):
+                    best = turn_order[j]
+                    best_distance = distance
+        
+        result[i] = best
+    return result
+
+def _assign_turns_numpy(seg_starts, seg_ends, turn_starts, turn_ends, tile=1024):
+    """
+    NumPy version of _assign_turns for when numba isn't installed.
+    
+    Computes the full segment x turn overlap matrix by broadcasting, a tile of
+    segments at a time to bound memory. Turns are in their original order, and
+    the results match _assign_turns.
+    """
+    result = np.empty(len(seg_starts), dtype=np.int64)
+    for i in range(0, len(seg_starts), tile):
+        starts = seg_starts[i:i + tile, None]
+        ends = seg_ends[i:i + tile, None]
+        
+        overlap = np.minimum(ends, turn_ends) - np.maximum(starts, turn_starts)
+        overlap = np.where((turn_starts < ends) & (turn_ends > starts), overlap, -np.inf)
+        # argmax/argmin return the first (earliest) turn on ties
+        best = overlap.argmax(axis=1)
+        
+        # No overlap: fall back to the nearest turn boundary
+        missing = np.isneginf(overlap[np.arange(len(best)), best])
+        if missing.any():
+            mids = (starts[missing] + ends[missing]) / 2
+            distance = np.minimum(np.abs(turn_starts - mids), np.abs(turn_ends - mids))
+            best[missing] = distance.argmin(axis=1)
+        
+        result[i:i + tile] = best
+    return result
+
+def compile_kernels():
+    """Compile the numba kernels ahead of the first request (a no-op without numba)"""
+    times = np.zeros(1)
+    _assign_turns(times, times, times, times, np.zeros(1, dtype=np.int64))
+
+def _use_fp16_embeddings(model, device):
+    """
+    Run a WeSpeaker embedding model's ResNet trunk under fp16 autocast on GPU.
+    
+    Only the trunk's convolutions move to fp16: the fbank front end sees
+    waveforms scaled to the int16 range, and its mel projection overflows in
+    fp16, so it stays in fp32 along with the returned embeddings. The fp16
+    trunk is kept only if it gives finite embeddings matching the fp32 ones on
+    a probe signal. CPU devices, models without a ResNet trunk, or
+    SYNCDUB_HIGH_PRECISION=1 leave the model in fp32.
+    """
+    if os.getenv("SYNCDUB_HIGH_PRECISION", "0") == "1" or torch.device(device).type != "cuda":
+        return
+    resnet = getattr(model, "resnet", None)
+    if not isinstance(resnet, torch.nn.Module):
+        return
+    forward = resnet.forward
+    
+    def fp16_forward(*args, **kwargs):
+        with torch.autocast("cuda", dtype=torch.float16):
+            outputs = forward(*args, **kwargs)
+        if isinstance(outputs, tuple):
+            return tuple(o.float() if torch.is_tensor(o) else o for o in outputs)
+        return outputs.float()
+    
+    # Three seconds of noise at 16 kHz, batch of two, through both paths
+    probe = 0.1 * torch.randn(2, 1, 48000, device=device)
+    with torch.inference_mode():
+        reference = model(probe)
+        resnet.forward = fp16_forward
+        embeddings = model(probe)
+    similarity = torch.nn.functional.cosine_similarity(embeddings, reference, dim=-1)
+    if not (torch.isfinite(embeddings).all() and similarity.min() > 0.99):
+        print(f"fp16 speaker embeddings deviate from fp32 (cosine {similarity.min().item():.4f}), keeping fp32")
+        resnet.forward = forward
+
+# Pretrained pyannote pipeline for the default backend
+DIARIZATION_PIPELINE = "pyannote/speaker-diarization-3.1"
+
+# Speaker embedding model used by the lightweight "simple" backend
+SIMPLE_EMBEDDING_MODEL = "pyannote/wespeaker-voxceleb-resnet34-LM"
+
 class SpeakerDiarizer:
-    def __init__(self, hf_token, device=None):
-        """Initialize speaker diarization with HuggingFace token"""
+    def __init__(self, hf_token, device=None, embedding_batch_size=None, segmentation_batch_size=None, backend="pyannote"):
+        """
+        Initialize speaker diarization with HuggingFace token
+        
+        Args:
+            hf_token: HuggingFace token for the gated pyannote models
+            device: Device to run on (defaults to cuda:0 when available)
+            embedding_batch_size: Override pyannote's default (32) embedding batch size
+            segmentation_batch_size: Override pyannote's default (32) segmentation batch size
+            backend: "pyannote" for the full pyannote pipeline, or "simple" for a single
+                     embedding pass over sliding windows followed by clustering
+        """
         self.diarization_pipeline = None
+        self.embedding_model = None
+        self.backend = backend
+        self.model_name = SIMPLE_EMBEDDING_MODEL if backend == "simple" else DIARIZATION_PIPELINE
+        self.embedding_batch_size = embedding_batch_size or 32
+        self.device = None
         try:
             print("Loading diarization pipeline...")
             # Check available devices
@@ -14,19 +168,75 @@ class SpeakerDiarizer:
                 device = "cuda:0" if torch.cuda.is_available() else "cpu"
             print(f"Using device: {device}")
             
+            if backend == "simple":
+                from pyannote.audio import Model
+                
+                self.embedding_model = Model.from_pretrained(SIMPLE_EMBEDDING_MODEL, use_auth_token=hf_token)
+                self.embedding_model.eval()
+                self.device = torch.device(device)
+                self.embedding_model.to(self.device)
+                _use_fp16_embeddings(self.embedding_model, self.device)
+                print("Speaker embedding model loaded successfully!")
+                return
+            
             # Use the newer version that's compatible with your libraries
             self.diarization_pipeline = Pipeline.from_pretrained(
-                "pyannote/speaker-diarization-3.1",
+                DIARIZATION_PIPELINE,
                 use_auth_token=hf_token
             )
-            self.diarization_pipeline.to(torch.device(device))
+            
+            # Smaller batches avoid VRAM thrashing on mid-range GPUs
+            if embedding_batch_size is not None:
+                self.diarization_pipeline.embedding_batch_size = embedding_batch_size
+            if segmentation_batch_size is not None:
+                self.diarization_pipeline.segmentation_batch_size = segmentation_batch_size
+            
+            self.device = torch.device(device)
+            self.diarization_pipeline.to(self.device)
+            
+            # Embedding extraction dominates pyannote's runtime
+            embedding = getattr(self.diarization_pipeline, "_embedding", None)
+            if isinstance(getattr(embedding, "model_", None), torch.nn.Module):
+                _use_fp16_embeddings(embedding.model_, self.device)
             print("Diarization model loaded successfully!")
         except Exception as e:
             print(f"Error loading diarization model: {e}")
     
+    def is_available(self):
+        """Whether the models for the selected backend loaded successfully"""
+        if self.backend == "simple":
+            return self.embedding_model is not None
+        return self.diarization_pipeline is not None
+    
+    def load_audio(self, audio_path, sample_rate=16000):
+        """
+        Decode an audio file once into pyannote's in-memory input format.
+        
+        Downmixing and resampling run on the pipeline's device, so pyannote
+        doesn't fall back to its single-threaded CPU resampler for every chunk.
+        
+        Args:
+            audio_path: Path to the audio file
+            sample_rate: Sample rate expected by the diarization models
+            
+        Returns:
+            Dictionary with 'waveform' (channel, time) tensor and 'sample_rate'
+        """
+        import torchaudio
+        
+        waveform, sr = torchaudio.load(audio_path)
+        waveform = waveform.to(self.device or torch.device("cpu"))
+        
+        if waveform.shape[0] > 1:
+            waveform = waveform.mean(dim=0, keepdim=True)
+        if sr != sample_rate:
+            waveform = torchaudio.functional.resample(waveform, sr, sample_rate)
+        
+        return {"waveform": waveform.cpu(), "sample_rate": sample_rate}
+    
     def diarize(self, audio_path, min_speakers=1, max_speakers=None, device=None):
-        """Identify speakers in audio file"""
-        if not self.diarization_pipeline:
+        """Identify speakers in an audio file or a preloaded waveform dict"""
+        if not self.is_available():
             print("Diarization pipeline not available")
             return []
         
@@ -44,15 +254,27 @@ class SpeakerDiarizer:
             # Set device if specified (cuda:0, cpu, etc.)
             if device:
                 print(f"Using device: {device}")
-                self.diarization_pipeline.to(torch.device(device))
+                self.device = torch.device(device)
+                (self.embedding_model or self.diarization_pipeline).to(self.device)
+            
+            # Decode and resample once up front instead of per chunk
+            if isinstance(audio_path, str):
+                audio_path = self.load_audio(audio_path)
+            
+            if self.backend == "simple":
+                speakers = self._diarize_simple(audio_path, min_speakers=min_speakers, max_speakers=max_speakers)
+                print(f"Diarization completed in {time.time() - start_time:.1f} seconds")
+                print(f"Detected {len(set(s['speaker'] for s in speakers))} unique speakers")
+                return speakers
             
             # Add progress updates
             print("Running diarization model...")
             print("This process may take several minutes with no visible progress...")
             print("Consider using a smaller audio segment for testing")
             
-            # Use the diarization pipeline
-            diarization = self.diarization_pipeline(audio_path, **params)
+            # Use the diarization pipeline (no autograd bookkeeping needed)
+            with torch.inference_mode():
+                diarization = self.diarization_pipeline(audio_path, **params)
             
             print("Processing diarization results...")
             speakers = []
@@ -68,10 +290,80 @@ class SpeakerDiarizer:
             print(f"Error during diarization: {e}")
             return []
     
+    def _diarize_simple(self, audio, min_speakers=1, max_speakers=None, window=1.5, step=0.75, threshold=0.7):
+        """
+        Lightweight diarization: embed overlapping windows of voiced audio in
+        batches and group them with agglomerative clustering.
+        
+        Args:
+            audio: Dictionary with mono 'waveform' (1, time) tensor and 'sample_rate'
+            min_speakers: Minimum number of speakers
+            max_speakers: Maximum number of speakers (None to decide by threshold)
+            window: Window length in seconds
+            step: Hop between windows in seconds
+            threshold: Cosine distance below which windows are merged into one speaker
+            
+        Returns:
+            List of speaker turns with 'start', 'end' and 'speaker' keys
+        """
+        from scipy.cluster.hierarchy import linkage, fcluster
+        
+        waveform = audio["waveform"][0]
+        sample_rate = audio["sample_rate"]
+        win, hop = int(window * sample_rate), int(step * sample_rate)
+        if waveform.shape[0] < win:
+            waveform = torch.nn.functional.pad(waveform, (0, win - waveform.shape[0]))
+        frames = waveform.unfold(0, win, hop)
+        
+        # Skip near-silent windows
+        rms = frames.pow(2).mean(dim=1).sqrt()
+        voiced = (rms > max(1e-4, 0.05 * float(rms.max()))).nonzero().squeeze(1)
+        if len(voiced) == 0:
+            return []
+        
+        embeddings = []
+        with torch.inference_mode():
+            for i in range(0, len(voiced), self.embedding_batch_size):
+                batch = frames[voiced[i:i + self.embedding_batch_size]].unsqueeze(1).to(self.device)
+                embeddings.append(self.embedding_model(batch).float().cpu())
+        embeddings = torch.cat(embeddings).numpy()
+        embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True) + 1e-8
+        
+        if len(embeddings) == 1:
+            labels = np.ones(1, dtype=int)
+        else:
+            tree = linkage(embeddings, method="average", metric="cosine")
+            labels = fcluster(tree, t=threshold, criterion="distance")
+            if max_speakers and labels.max() > max_speakers:
+                labels = fcluster(tree, t=max_speakers, criterion="maxclust")
+            elif min_speakers and labels.max() < min_speakers <= len(embeddings):
+                labels = fcluster(tree, t=min_speakers, criterion="maxclust")
+        
+        # Each window owns the step-long span around its centre; merge runs of
+        # adjacent windows with the same label into turns
+        offset = (window - step) / 2
+        names = {}
+        speakers = []
+        previous = None
+        for index, label in zip(voiced.tolist(), labels.tolist()):
+            name = names.setdefault(label, f"SPEAKER_{len(names):02d}")
+            start = index * step + (offset if index else 0)
+            end = index * step + offset + step
+            if previous is not None and previous == index - 1 and speakers[-1]["speaker"] == name:
+                speakers[-1]["end"] = end
+            else:
+                speakers.append({'start': start, 'end': end, 'speaker': name})
+            previous = index
+        
+        return speakers
+    
     def assign_speakers_to_segments(self, segments, speakers):
         """
         Assign speaker labels to transcript segments based on timing overlap
         
+        Only segment timings are used, so this works equally on original or
+        already-translated segments.
+        
         Args:
             segments: List of transcript segments with start/end times
             speakers: List of speaker segments from diarization
@@ -92,60 +384,29 @@ class SpeakerDiarizer:
                 segment["speaker"] = speaker_id
             return segments
         
-        # Process each segment
-        for segment in segments:
-            segment_start = segment.get("start", 0)
-            segment_end = segment.get("end", 0)
-            segment_duration = segment_end - segment_start
-            
-            # Find overlapping speakers
-            speaker_overlaps = []
-            
-            for speaker_turn in speakers:
-                # Fast check for any overlap
-                if not (speaker_turn["end"] <= segment_start or speaker_turn["start"] >= segment_end):
-                    # Calculate overlap duration
-                    overlap_start = max(speaker_turn["start"], segment_start)
-                    overlap_end = min(speaker_turn["end"], segment_end)
-                    overlap_duration = overlap_end - overlap_start
-                    
-                    # Calculate overlap percentage relative to segment duration
-                    overlap_percentage = overlap_duration / segment_duration if segment_duration > 0 else 0
-                    
-                    speaker_overlaps.append((speaker_turn["speaker"], overlap_duration, overlap_percentage))
-            
-            # Assign speaker with the most overlap
-            if speaker_overlaps:
-                # Sort by overlap duration (descending)
-                speaker_overlaps.sort(key=lambda x: x[1], reverse=True)
-                segment["speaker"] = speaker_overlaps[0][0]
-                
-                # Add confidence score if desired
-                # segment["speaker_confidence"] = speaker_overlaps[0][2]
-            else:
-                # Find nearest speaker if no overlap
-                segment_mid = (segment_start + segment_end) / 2
-                
-                closest_speaker = min(
-                    speakers,
-                    key=lambda s: min(
-                        abs(s["start"] - segment_mid),
-                        abs(s["end"] - segment_mid)
-                    )
-                )
-                segment["speaker"] = closest_speaker["speaker"]
-                
-                # You can log this if logging is set up
-                # print(f"No speaker overlap found for segment at {segment_start:.2f}s, using nearest speaker")
+        seg_starts = np.array([segment.get("start", 0) for segment in segments], dtype=np.float64)
+        seg_ends = np.array([segment.get("end", 0) for segment in segments], dtype=np.float64)
+        turn_starts = np.array([turn["start"] for turn in speakers], dtype=np.float64)
+        turn_ends = np.array([turn["end"] for turn in speakers], dtype=np.float64)
+        
+        if HAVE_NUMBA:
+            # Match every segment against the time-sorted turns in one compiled pass
+            order = np.argsort(turn_starts, kind="stable")
+            choices = _assign_turns(seg_starts, seg_ends, turn_starts[order], turn_ends[order], order)
+        else:
+            choices = _assign_turns_numpy(seg_starts, seg_ends, turn_starts, turn_ends)
+        for segment, choice in zip(segments, choices):
+            segment["speaker"] = speakers[choice]["speaker"]
         
         return segments
     
-    def extract_speaker_references(self, audio_path, speakers, output_dir="reference_audio", min_duration=3.0, max_duration=10.0):
+    def extract_speaker_references(self, audio, speakers, output_dir="reference_audio", min_duration=3.0, max_duration=10.0):
         """
         Extract reference audio clips for each unique speaker.
         
         Args:
-            audio_path: Path to the original audio file
+            audio: Path to the original audio file, or an in-memory dict with a
+                   (channel, time) 'waveform' and its 'sample_rate'
             speakers: List of speaker segments from diarization
             output_dir: Directory to save reference audio clips
             min_duration: Minimum duration for a reference clip (seconds)
@@ -154,18 +415,32 @@ class SpeakerDiarizer:
         Returns:
             Dictionary mapping speaker IDs to reference audio file paths
         """
-        import os
-        from pydub import AudioSegment
+        import soundfile as sf
         
         # Ensure output directory exists
         os.makedirs(output_dir, exist_ok=True)
         
-        # Load the original audio file
-        try:
-            full_audio = AudioSegment.from_file(audio_path)
-        except Exception as e:
-            print(f"Error loading audio file: {e}")
-            return {}
+        # Only the selected clips are read, so the full file is never decoded
+        if isinstance(audio, dict):
+            waveform = audio["waveform"]
+            if isinstance(waveform, torch.Tensor):
+                waveform = waveform.cpu().numpy()
+            waveform = np.asarray(waveform, dtype=np.float32)
+            if waveform.ndim == 1:
+                waveform = waveform[None]
+            sample_rate = audio["sample_rate"]
+            
+            def read_clip(start, stop):
+                return waveform[:, start:stop].T
+        else:
+            try:
+                sample_rate = sf.info(audio).samplerate
+            except Exception as e:
+                print(f"Error loading audio file: {e}")
+                return {}
+            
+            def read_clip(start, stop):
+                return sf.read(audio, start=start, stop=stop, dtype="float32", always_2d=True)[0]
         
         # Get unique speaker IDs
         unique_speakers = set(segment["speaker"] for segment in speakers)
@@ -203,16 +478,16 @@ class SpeakerDiarizer:
                 
             # Extract the audio segment
             if selected_segment:
-                start_ms = int(selected_segment["start"] * 1000)
-                end_ms = int(selected_segment["end"] * 1000)
+                start = max(0, int(selected_segment["start"] * sample_rate))
+                stop = int(selected_segment["end"] * sample_rate)
                 
                 # Extract audio segment
-                speaker_audio = full_audio[start_ms:end_ms]
+                speaker_audio = read_clip(start, stop)
                 
                 # Save to file
                 speaker_id = speaker.replace("SPEAKER_", "")
                 output_path = os.path.join(output_dir, f"speaker_{speaker_id}_reference.wav")
-                speaker_audio.export(output_path, format="wav")
+                sf.write(output_path, speaker_audio, sample_rate)
                 
                 reference_files[speaker] = output_path
                 
@@ -1,29 +1,30 @@
 import numpy as np
 import os
 import re
+import asyncio
 import tempfile
 import logging
+import threading
 import torch
 from pydub import AudioSegment
 from pathlib import Path
-import subprocess
 import librosa
 import soundfile as sf
+import edge_tts
+import pipeline_cache
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import uvloop  # Faster event loop for the concurrent Edge TTS requests (Linux/macOS)
+except ImportError:
+    uvloop = None
 
 
 # Set up basic logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Create directory structure
-def ensure_directories():
-    """Ensure the required directories exist"""
-    directories = ["audio", "audio2", "reference_audio"]
-    for directory in directories:
-        os.makedirs(directory, exist_ok=True)
-    
-ensure_directories()  # Call immediately to ensure directories exist
-
 # Setup audio effects for pydub
 def setup_audio_effects():
     """Setup custom audio effects"""
@@ -58,6 +59,18 @@ def setup_audio_effects():
 
 effects = setup_audio_effects()
 
+# Diarization labels look like "SPEAKER_00"; the regex is only a fallback
+SPEAKER_PREFIX = "SPEAKER_"
+_SPEAKER_RE = re.compile(r'SPEAKER_(\d+)')
+
+def parse_speaker_id(speaker, default=None):
+    """Extract the numeric speaker index from a diarization label like 'SPEAKER_01'"""
+    suffix = speaker[len(SPEAKER_PREFIX):]
+    if speaker.startswith(SPEAKER_PREFIX) and suffix.isdigit():
+        return int(suffix)
+    match = _SPEAKER_RE.search(speaker)
+    return int(match.group(1)) if match else default
+
 def adjust_audio_duration(audio_segment, target_duration):
     """Adjust audio to target duration by adding silence or trimming"""
     current_duration = len(audio_segment) / 1000  # ms to seconds
@@ -69,30 +82,144 @@ def adjust_audio_duration(audio_segment, target_duration):
     else:
         return audio_segment[:int(target_duration * 1000)]
 
-# XTTS Model Loader (Singleton pattern)
+# XTTS Model Loader (one model per device, like the pooled ASR and diarization
+# models, so concurrent runs on different GPUs each use their own)
 class XTTSModelLoader:
-    _instance = None
-    model = None
+    _lock = threading.Lock()
+    models = {}
+    
+    @staticmethod
+    def default_device():
+        """Device used when none is given: the first GPU when available"""
+        return "cuda:0" if torch.cuda.is_available() else "cpu"
     
     @classmethod
-    def get_model(cls):
-        """Get or initialize the XTTS model"""
-        if cls.model is None:
-            try:
-                from TTS.api import TTS
-                
-                # Determine device
-                device = "cuda" if torch.cuda.is_available() else "cpu"
-                logger.info(f"Loading XTTS model on {device}...")
-                
-                # Load the model
-                cls.model = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
-                logger.info("XTTS model loaded successfully")
-            except Exception as e:
-                logger.error(f"Error loading XTTS model: {e}")
-                return None
-                
-        return cls.model
+    def get_model(cls, device=None):
+        """Get or initialize the XTTS model for a device (safe to call from several threads)"""
+        device = str(device or cls.default_device())
+        if device == "cuda":
+            device = "cuda:0"
+        if cls.models.get(device) is None:
+            with cls._lock:
+                if cls.models.get(device) is None:
+                    cls.models[device] = cls._load(device)
+        return cls.models[device]
+    
+    @classmethod
+    def _load(cls, device):
+        """Load the XTTS model onto the given device; returns None on failure"""
+        try:
+            from TTS.api import TTS
+            
+            logger.info(f"Loading XTTS model on {device}...")
+            
+            # Load the model
+            model = TTS("tts_models/multilingual/multi-dataset/xtts_v2").to(device)
+            logger.info("XTTS model loaded successfully")
+            
+            if device == "cpu" and os.getenv("SYNCDUB_XTTS_INT8", "0") == "1":
+                cls._quantize(model.synthesizer.tts_model)
+            if os.getenv("SYNCDUB_TORCH_COMPILE", "0") == "1":
+                cls._compile_decoder(model.synthesizer.tts_model)
+            return model
+        except Exception as e:
+            logger.error(f"Error loading XTTS model: {e}")
+            return None
+    
+    @staticmethod
+    def _quantize(xtts):
+        """
+        Quantize the XTTS GPT's linear layers to int8 for CPU inference
+        
+        Dynamic quantization halves the weight bytes read per generated token,
+        which is what bounds autoregressive decoding on CPU.
+        """
+        try:
+            xtts.gpt = torch.quantization.quantize_dynamic(xtts.gpt, {torch.nn.Linear}, dtype=torch.qint8)
+            logger.info("XTTS GPT quantized to int8")
+        except Exception as e:
+            logger.warning(f"Could not quantize XTTS, using fp32: {e}")
+    
+    @staticmethod
+    def _compile_decoder(xtts):
+        """
+        Compile the XTTS HiFi-GAN vocoder with torch.compile
+        
+        Only the vocoder is compiled: it is a stack of small convolutions that
+        fuse well, while the autoregressive GPT generates variable-length
+        sequences that would trigger a recompile on almost every segment.
+        Compilation happens lazily on the first synthesis.
+        """
+        if not hasattr(torch, "compile"):
+            logger.warning("torch.compile is not available in this PyTorch version")
+            return
+        try:
+            xtts.hifigan_decoder = torch.compile(xtts.hifigan_decoder, dynamic=True)
+            logger.info("XTTS vocoder compiled with torch.compile")
+        except Exception as e:
+            logger.warning(f"Could not compile XTTS vocoder, using eager mode: {e}")
+
+# Reference clips are keyed by a sampled hash: the file size plus 4 KiB from
+# the start, middle and end, so keying a speaker reads 12 KiB instead of the
+# whole WAV. This is not a full content hash. Most clips are exactly 10 s, so
+# their sizes and headers match and only the ~12 KiB of samples tell them
+# apart. Two clips that agree there would share cached latents and segments,
+# i.e. a speaker would silently get the other clip's voice.
+REFERENCE_SAMPLE_SIZE = 4096
+
+# In-process LRU of conditioning latents, keyed like the on-disk entries plus
+# the device the latents were moved to
+LATENTS_CACHE_SIZE = 50
+_LATENTS = OrderedDict()
+_LATENTS_LOCK = threading.Lock()
+
+def get_xtts_conditioning_latents(reference_audio, device=None):
+    """
+    Encode a speaker's reference audio into XTTS conditioning latents
+    
+    Args:
+        reference_audio: Path to the speaker's reference audio
+        device: Device of the XTTS model to use (defaults to the first GPU)
+        
+    Returns:
+        Tuple of (gpt_cond_latent, speaker_embedding)
+    """
+    tts_model = XTTSModelLoader.get_model(device)
+    if tts_model is None:
+        raise RuntimeError("XTTS model could not be loaded. Ensure TTS is installed.")
+    
+    xtts = tts_model.synthesizer.tts_model
+    key = f"xtts_v2:latents:{pipeline_cache.file_digest(reference_audio, REFERENCE_SAMPLE_SIZE)}"
+    memory_key = (key, str(xtts.device))
+    
+    # Recently used speakers stay in memory, already on the model's device
+    with _LATENTS_LOCK:
+        if memory_key in _LATENTS:
+            _LATENTS.move_to_end(memory_key)
+            return _LATENTS[memory_key]
+    
+    # Latents depend only on the clip's contents, so they are also cached on
+    # disk (on CPU) and reused whenever the same reference clip comes back
+    def compute():
+        return tuple(latent.cpu() for latent in xtts.get_conditioning_latents(audio_path=[reference_audio]))
+    
+    latents = tuple(latent.to(xtts.device) for latent in pipeline_cache.cached(key, compute))
+    with _LATENTS_LOCK:
+        _LATENTS[memory_key] = latents
+        while len(_LATENTS) > LATENTS_CACHE_SIZE:
+            _LATENTS.popitem(last=False)
+    return latents
+
+def _xtts_inference_to_file(text, language, conditioning_latents, file_path, device=None, **kwargs):
+    """Synthesize text from precomputed conditioning latents and write it as a WAV file"""
+    xtts = XTTSModelLoader.get_model(device).synthesizer.tts_model
+    gpt_cond_latent, speaker_embedding = conditioning_latents
+    
+    out = xtts.inference(text, language, gpt_cond_latent, speaker_embedding, **kwargs)
+    wav = out["wav"]
+    if torch.is_tensor(wav):
+        wav = wav.squeeze().cpu().numpy()
+    sf.write(file_path, np.asarray(wav), xtts.config.audio.output_sample_rate)
 
 def smooth_speed_change(audio_path, target_duration):
     """
@@ -157,17 +284,7 @@ def smooth_speed_change(audio_path, target_duration):
         
         # Calculate new duration
         expected_duration = len(stretched_audio) / sr
-        
-        # Save to temporary file
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
-        sf.write(temp_file.name, stretched_audio, sr)
-        
-        # Calculate processing time
-        process_time = time.time() - start_time
-        
-        # Verify the actual duration after processing
-        y_check, sr_check = librosa.load(temp_file.name, sr=None)
-        actual_duration = librosa.get_duration(y=y_check, sr=sr_check)
+        actual_duration = expected_duration
         
         method = "direct"
         
@@ -175,26 +292,32 @@ def smooth_speed_change(audio_path, target_duration):
         if extreme_adjustment and actual_duration > target_duration:
             print(f"[DEBUG] Performing additional trim for extreme case")
             # Calculate how many samples to keep
-            samples_to_keep = int(target_duration * sr_check)
+            samples_to_keep = int(target_duration * sr)
             
             # Apply a small fade out to avoid clicks
-            fade_samples = min(int(0.1 * sr_check), samples_to_keep // 4)  # 100ms fade or less
+            fade_samples = min(int(0.1 * sr), samples_to_keep // 4)  # 100ms fade or less
             
             # Keep only the needed samples
-            trimmed_audio = y_check[:samples_to_keep]
+            stretched_audio = stretched_audio[:samples_to_keep]
             
             # Apply fade out to avoid clicks
             if fade_samples > 0:
                 fade_env = np.linspace(1.0, 0.0, fade_samples)
-                trimmed_audio[-fade_samples:] *= fade_env
-            
-            # Save the trimmed version
-            sf.write(temp_file.name, trimmed_audio, sr_check)
+                stretched_audio[-fade_samples:] *= fade_env
             
             # Update actual duration
-            actual_duration = librosa.get_duration(y=trimmed_audio, sr=sr_check)
+            actual_duration = len(stretched_audio) / sr
             method += "+trim"
         
+        # Save to temporary file (the stretched samples are already in memory,
+        # so the result is written once and never re-read to measure it)
+        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.wav')
+        temp_file.close()
+        sf.write(temp_file.name, stretched_audio, sr)
+        
+        # Calculate processing time
+        process_time = time.time() - start_time
+        
         print(f"[DEBUG] Method used: {method}")
         print(f"[DEBUG] Processing completed in {process_time:.2f} seconds")
         print(f"[DEBUG] Expected new duration: {expected_duration:.2f}s")
@@ -212,8 +335,39 @@ def smooth_speed_change(audio_path, target_duration):
         logger.warning(f"Audio speed adjustment failed: {e}")
         return audio_path
 
-def create_segmented_edge_tts(text, pitch, voice, output_path, target_duration=None):
-    """Create voice clone with specific characteristics and timing using Edge TTS"""
+def run_async(coro):
+    """Run a coroutine to completion on a fresh event loop, using uvloop when installed"""
+    if uvloop is None:
+        return asyncio.run(coro)
+    
+    loop = uvloop.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coro)
+    finally:
+        try:
+            # Same teardown as asyncio.run: cancel leftovers, close async generators
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+async def _edge_tts_save(text, voice, pitch_param, output_path, rate="+0%"):
+    """Synthesize text with Edge TTS and save the MP3 to output_path"""
+    communicate = edge_tts.Communicate(text, voice, rate=rate, pitch=pitch_param)
+    await communicate.save(output_path)
+
+async def create_segmented_edge_tts_async(text, pitch, voice, output_path, target_duration=None):
+    """
+    Create voice clone with specific characteristics and timing using Edge TTS
+    
+    Network calls are awaited so many segments can be synthesized concurrently;
+    audio decoding/encoding runs in a worker thread to keep the event loop free.
+    """
     # Create a temporary file
     temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
     temp_filename = temp_file.name  # Store filename before closing
@@ -222,16 +376,9 @@ def create_segmented_edge_tts(text, pitch, voice, output_path, target_duration=N
     # Fix pitch formatting
     pitch_param = f"+{pitch}Hz" if pitch >= 0 else f"{pitch}Hz"
     
-    command = [
-        "edge-tts",
-        f"--pitch={pitch_param}",
-        "--voice", voice,
-        "--text", text,
-        "--write-media", temp_filename
-    ]
-    subprocess.run(command, check=True)
+    await _edge_tts_save(text, voice, pitch_param, temp_filename)
     # Load audio
-    audio = AudioSegment.from_file(temp_filename, format="mp3")
+    audio = await asyncio.to_thread(AudioSegment.from_file, temp_filename, format="mp3")
     
     # Time constraint adjustment
     if target_duration is not None:
@@ -250,22 +397,11 @@ def create_segmented_edge_tts(text, pitch, voice, output_path, target_duration=N
             else:
                 rate_adjustment = f"+{int((speed_factor - 1) * 100)}%"
             
-            # Regenerate with adjusted rate
-            os.unlink(temp_file.name)  # Remove the previous temp file
-            
-            # Create new command with rate parameter and fixed pitch formatting
-            command = [
-                "edge-tts",
-                f"--pitch={pitch_param}",
-                f"--rate={rate_adjustment}",
-                "--voice", voice,
-                "--text", text,
-                "--write-media", temp_filename
-            ]
-            subprocess.run(command, check=True)
+            # Regenerate with adjusted rate (overwrites the previous temp file)
+            await _edge_tts_save(text, voice, pitch_param, temp_filename, rate=rate_adjustment)
             
             # Reload audio with rate adjustment
-            audio = AudioSegment.from_file(temp_filename, format="mp3")
+            audio = await asyncio.to_thread(AudioSegment.from_file, temp_filename, format="mp3")
             
             # Fine-tune if needed
             new_duration = len(audio) / 1000
@@ -273,22 +409,52 @@ def create_segmented_edge_tts(text, pitch, voice, output_path, target_duration=N
                 audio = adjust_audio_duration(audio, target_duration)
     
     # Save the modified audio
-    audio.export(output_path, format="wav")
+    await asyncio.to_thread(audio.export, output_path, format="wav")
     
     # Clean up temporary file
-    os.unlink(temp_file.name)
+    os.unlink(temp_filename)
     
     # Log final duration
-    final_audio = AudioSegment.from_file(output_path)
-    final_duration = len(final_audio) / 1000
+    final_duration = len(audio) / 1000
     logger.info(f"  Final duration: {final_duration:.2f}s (target: {target_duration if target_duration else 'None'}s)")
     
     return output_path
 
-def create_segmented_xtts(text, reference_audio, language, output_path, target_duration=None):
-    """Create voice-cloned speech using XTTS with speaker's reference audio and duration control"""
+def create_segmented_edge_tts(text, pitch, voice, output_path, target_duration=None):
+    """Create voice clone with specific characteristics and timing using Edge TTS"""
+    return run_async(create_segmented_edge_tts_async(text, pitch, voice, output_path, target_duration))
+
+async def _run_edge_tts_jobs(jobs, concurrency, on_done=None):
+    """Run Edge TTS jobs concurrently, with at most `concurrency` requests in flight"""
+    semaphore = asyncio.Semaphore(concurrency)
+    
+    async def bounded(job):
+        async with semaphore:
+            result = await create_segmented_edge_tts_async(**job)
+        if on_done is not None:
+            on_done()
+        return result
+    
+    return await asyncio.gather(*(bounded(job) for job in jobs))
+
+def _run_edge_batch(jobs, concurrency, on_done=None):
+    """Synthesize a list of Edge TTS jobs concurrently on a fresh event loop"""
+    logger.info(f"Generating {len(jobs)} Edge TTS segments ({concurrency} concurrent requests)")
+    # Start the longest texts first so a few long requests don't trail at the end
+    # (each job writes its own file, so the overlay order is unaffected)
+    jobs.sort(key=lambda job: len(job['text']), reverse=True)
+    run_async(_run_edge_tts_jobs(jobs, concurrency, on_done))
+
+def create_segmented_xtts(text, reference_audio, language, output_path, target_duration=None, conditioning_latents=None, device=None):
+    """
+    Create voice-cloned speech using XTTS with speaker's reference audio and duration control
+    
+    If conditioning_latents (gpt_cond_latent, speaker_embedding) are given, the
+    reference audio is not re-encoded for this segment. device selects the
+    XTTS model to use (defaults to the first GPU).
+    """
     # Get the model (will be loaded on first call)
-    tts_model = XTTSModelLoader.get_model()
+    tts_model = XTTSModelLoader.get_model(device)
     
     if tts_model is None:
         raise RuntimeError("XTTS model could not be loaded. Ensure TTS is installed.")
@@ -325,8 +491,17 @@ def create_segmented_xtts(text, reference_audio, language, output_path, target_d
             generation_kwargs['speed'] = 1.2  # Slightly faster for short text
     
     try:
+        if conditioning_latents is not None:
+            # Synthesize straight from the speaker's cached latents
+            try:
+                _xtts_inference_to_file(text, language, conditioning_latents, temp_filename, device, **generation_kwargs)
+            except (TypeError, ValueError):
+                if not generation_kwargs:
+                    raise
+                logger.info("  Advanced parameters not supported, using standard generation")
+                _xtts_inference_to_file(text, language, conditioning_latents, temp_filename, device)
         # Try generating with optional parameters if supported
-        if generation_kwargs:
+        elif generation_kwargs:
             try:
                 tts_model.tts_to_file(
                     text=text,
@@ -497,7 +672,30 @@ def process_voice_config(voice_config):
     
     return processed_config
 
-def generate_tts(segments, target_language, voice_config=None, output_dir="audio2"):
+def _segment_cache_key(speaker_config, text, target_language, duration):
+    """
+    Pipeline cache key for one synthesized segment
+    
+    Covers everything that shapes the segment's audio: the engine and voice
+    (an XTTS speaker is identified by its reference clip's contents), the
+    language, the target duration it is stretched to, and the text itself.
+    
+    Returns:
+        The key, or None if the segment can't be cached
+    """
+    if speaker_config['engine'] == 'xtts':
+        try:
+            voice = f"xtts_v2:{pipeline_cache.file_digest(speaker_config['reference_audio'], REFERENCE_SAMPLE_SIZE)}"
+        except OSError:
+            return None
+        language = speaker_config.get('language', target_language)
+    else:
+        voice = f"edge:{speaker_config.get('voice', 'hi-IN-SwaraNeural')}:{speaker_config.get('pitch', 0)}"
+        language = target_language
+    return f"tts:{voice}:{language}:{duration:.3f}:{text}"
+
+def generate_tts(segments, target_language, voice_config=None, output_dir="audio2", edge_concurrency=None,
+                 conditioning_latents=None, segment_dir="audio", use_cache=True, progress_callback=None, device=None):
     """
     Generate speech for all segments using appropriate TTS engine per speaker
     
@@ -508,12 +706,25 @@ def generate_tts(segments, target_language, voice_config=None, output_dir="audio
                      - For Edge TTS: {'gender': 'male'/'female'} or just 'male'/'female'
                      - For XTTS: {'engine': 'xtts', 'reference_audio': '/path/to/audio.wav'}
         output_dir: Directory to save the final audio
+        edge_concurrency: Maximum number of concurrent Edge TTS requests
+                     (defaults to EDGE_TTS_CONCURRENCY, or 16)
+        conditioning_latents: Optional dict of speaker_id -> (gpt_cond_latent, speaker_embedding)
+                     for XTTS speakers whose latents were computed beforehand
+        segment_dir: Directory for the per-segment audio files
+        use_cache: Reuse segments synthesized earlier with the same text, voice
+                   and target duration (from the pipeline cache)
+        progress_callback: Optional callable (done, total) invoked as segments
+                   finish; may be called from worker threads
+        device: Device whose XTTS model synthesizes voice-cloned segments
+                   (defaults to the first GPU)
         
     Returns:
         Path to the final combined audio file
     """
     # Ensure output directory exists
     os.makedirs(output_dir, exist_ok=True)
+    if edge_concurrency is None:
+        edge_concurrency = int(os.getenv("EDGE_TTS_CONCURRENCY", "16"))
     
     # Generate the full audio
     output_path = os.path.join(output_dir, "dubbed_conversation.wav")
@@ -521,19 +732,47 @@ def generate_tts(segments, target_language, voice_config=None, output_dir="audio
     
     # Create a silent audio of the total duration
     combined = AudioSegment.silent(duration=int(max_end_time * 1000) + 100) 
-    ensure_directories()
+    os.makedirs(segment_dir, exist_ok=True)
     audio_files = []
     
     # Process voice configuration
     processed_config = process_voice_config(voice_config or {})
     print(processed_config)
     
-    # Process each segment
+    # Encode each XTTS speaker's reference audio once, rather than once per segment
+    conditioning_latents = conditioning_latents or {}
+    for speaker_id, config in processed_config.items():
+        if config['engine'] != 'xtts':
+            continue
+        if speaker_id in conditioning_latents:
+            config['gpt_cond_latent'], config['speaker_embedding'] = conditioning_latents[speaker_id]
+            continue
+        try:
+            config['gpt_cond_latent'], config['speaker_embedding'] = get_xtts_conditioning_latents(config['reference_audio'], device)
+        except Exception as e:
+            logger.warning(f"Could not compute conditioning latents for speaker {speaker_id}: {e}")
+    
+    # Plan every segment first: Edge TTS segments are network-bound and are
+    # synthesized concurrently, XTTS segments run one at a time on the model
+    edge_jobs = []
+    xtts_jobs = defaultdict(list)  # speaker_id -> that speaker's segments
+    fresh_segments = {}  # output_file -> segment cache key, for segments synthesized now
+    
+    done_count = [0]
+    done_lock = threading.Lock()
+    
+    def segment_done():
+        """Count a finished segment and report it"""
+        if progress_callback is None:
+            return
+        with done_lock:
+            done_count[0] += 1
+            done = done_count[0]
+        progress_callback(done, len(segments))
     for i, segment in enumerate(segments):
         # Extract speaker ID
         speaker = segment.get('speaker', 'SPEAKER_00')
-        match = re.search(r'SPEAKER_(\d+)', speaker)
-        speaker_id = int(match.group(1)) if match else 0
+        speaker_id = parse_speaker_id(speaker, default=0)
         
         # Get speaker configuration
         speaker_config = processed_config.get(speaker_id, 
@@ -545,48 +784,102 @@ def generate_tts(segments, target_language, voice_config=None, output_dir="audio
         end = segment['end']
         duration = end - start
         
-        # Create output filename
-        output_file = f"audio/{start}.wav"
+        # Create output filename (indexed, so concurrent segments never collide)
+        output_file = os.path.join(segment_dir, f"{i:05d}_{start}.wav")
+        audio_files.append(output_file)
         
         logger.info(f"Processing segment {i+1} (Speaker {speaker_id}, Engine: {speaker_config['engine']}):")
         logger.info(f"  Text: {text[:50]}{'...' if len(text) > 50 else ''}")
         logger.info(f"  Duration: {duration:.2f}s")
         
+        # Repeated phrases and re-runs reuse previously synthesized segments
+        cache_key = _segment_cache_key(speaker_config, text, target_language, duration)
+        if use_cache and cache_key is not None:
+            cached_audio = pipeline_cache.get(cache_key)
+            if cached_audio is not None:
+                with open(output_file, "wb") as f:
+                    f.write(cached_audio)
+                logger.info("  Reusing cached segment audio")
+                segment_done()
+                continue
+            fresh_segments[output_file] = cache_key
+        
         # Choose appropriate TTS engine
         if speaker_config['engine'] == 'xtts':
-            # XTTS generation with speaker's reference audio
-            try:
-                create_segmented_xtts(
-                    text=text,
-                    reference_audio=speaker_config['reference_audio'],
-                    language=speaker_config.get('language', target_language),
-                    output_path=output_file,
-                    target_duration=duration,
-                )
-            except Exception as e:
-                logger.error(f"Error using XTTS for speaker {speaker_id}: {e}")
-                logger.warning(f"Falling back to Edge TTS for this segment")
-                # Fallback to Edge TTS
-                create_segmented_edge_tts(
-                    text=text,
-                    pitch=0, 
-                    voice="hi-IN-SwaraNeural",
-                    output_path=output_file,
-                    target_duration=duration,
-                )
+            xtts_jobs[speaker_id].append((speaker_config, text, output_file, duration))
         else:
-            # Edge TTS generation
-            create_segmented_edge_tts(
-                text=text,
-                pitch=speaker_config.get('pitch', 0),
-                voice=speaker_config.get('voice', "hi-IN-SwaraNeural"),
-                output_path=output_file,
-                target_duration=duration,
-            )
-        
-        audio_files.append(output_file)
-
-        # Add segment to combined audio at the exact timestamp
+            edge_jobs.append({
+                'text': text,
+                'pitch': speaker_config.get('pitch', 0),
+                'voice': speaker_config.get('voice', "hi-IN-SwaraNeural"),
+                'output_path': output_file,
+                'target_duration': duration,
+            })
+    
+    # Edge TTS is network-bound and XTTS runs on the GPU, so the Edge TTS
+    # requests go out in the background while XTTS synthesizes
+    edge_executor = ThreadPoolExecutor(max_workers=1) if edge_jobs else None
+    edge_future = edge_executor.submit(_run_edge_batch, edge_jobs, edge_concurrency, segment_done) if edge_jobs else None
+    
+    # XTTS generation with each speaker's reference audio, one speaker at a time
+    # so that speaker's latents stay hot; failed segments fall back to Edge TTS
+    fallback_jobs = []
+    xtts_ready = bool(xtts_jobs) and XTTSModelLoader.get_model(device) is not None
+    for speaker_id, jobs in xtts_jobs.items():
+        for speaker_config, text, output_file, duration in jobs:
+            if not xtts_ready:
+                error = "XTTS model could not be loaded"
+            else:
+                try:
+                    create_segmented_xtts(
+                        text=text,
+                        reference_audio=speaker_config['reference_audio'],
+                        language=speaker_config.get('language', target_language),
+                        output_path=output_file,
+                        target_duration=duration,
+                        conditioning_latents=(
+                            (speaker_config['gpt_cond_latent'], speaker_config['speaker_embedding'])
+                            if 'gpt_cond_latent' in speaker_config else None
+                        ),
+                        device=device,
+                    )
+                except Exception as e:
+                    error = e
+                else:
+                    segment_done()
+                    continue
+            
+            logger.error(f"Error using XTTS for speaker {speaker_id}: {error}")
+            logger.warning(f"Falling back to Edge TTS for this segment")
+            fresh_segments.pop(output_file, None)  # Not the voice the cache key describes
+            fallback_jobs.append({
+                'text': text,
+                'pitch': 0,
+                'voice': "hi-IN-SwaraNeural",
+                'output_path': output_file,
+                'target_duration': duration,
+            })
+    
+    if edge_future is not None:
+        try:
+            edge_future.result()
+        finally:
+            edge_executor.shutdown()
+    
+    # Segments XTTS couldn't synthesize
+    if fallback_jobs:
+        _run_edge_batch(fallback_jobs, edge_concurrency, segment_done)
+    
+    if use_cache:
+        for output_file, cache_key in fresh_segments.items():
+            try:
+                with open(output_file, "rb") as f:
+                    pipeline_cache.put(cache_key, f.read())
+            except OSError as e:
+                logger.warning(f"Could not cache segment {output_file}: {e}")
+    
+    # Add each segment to combined audio at the exact timestamp
+    for segment, output_file in zip(segments, audio_files):
         segment_audio = AudioSegment.from_file(output_file)
         position_ms = int(segment['start'] * 1000)
         combined = combined.overlay(segment_audio, position=position_ms)
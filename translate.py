@@ -1,17 +1,15 @@
+import re
 import json
 import copy
+import random
 import logging
 import time
 from typing import List, Dict, Optional, Any, Union
 from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 from deep_translator import GoogleTranslator
-from dotenv import load_dotenv
-
-# Add this at the top of your translate.py file
-# Load environment variables from .env file
-load_dotenv()
-
+import pipeline_cache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -38,6 +36,27 @@ ISO_LANGUAGE_CODES = {
     "ar": "arabic",
 }
 
+# Groq translations are kept in the pipeline cache, one entry per
+# (text, target language, model), so they survive "Reset Everything"
+def _groq_cache_key(text: str, target_lang: str, model_name: str) -> str:
+    """Build the pipeline cache key for a single Groq translation."""
+    return f"groq:{model_name}:{target_lang}:{text}"
+
+def _load_groq_translations(keys: List[str]) -> Dict[str, str]:
+    """Look up cached Groq translations for the given keys (misses are left out)."""
+    cached = {}
+    for key in dict.fromkeys(keys):
+        translation = pipeline_cache.get(key)
+        if translation is not None:
+            cached[key] = translation
+    return cached
+
+def _store_groq_translations(cache: Dict[str, str], batch: List[tuple], translated_texts: List[Any]) -> None:
+    """Record a batch's translations in the run's lookup dict and the pipeline cache."""
+    for (key, _), text in zip(batch, translated_texts):
+        cache[key] = str(text)
+        pipeline_cache.put(key, cache[key])
+
 def fix_language_code(language_code: Optional[str]) -> str:
     """Convert language code to format compatible with translator."""
     if not language_code:
@@ -135,7 +154,7 @@ def translate_batch(segments: List[Dict[str, Any]],
     
     for line in text_lines:
         line = " " if not line else line
-        if (len(current_chunk) + len(line) + 7) <= chunk_size:  # 7 for separator
+        if not current_chunk or (len(current_chunk) + len(line) + 7) <= chunk_size:  # 7 for separator
             if current_chunk:
                 current_chunk += " ||||| "
             current_chunk += line
@@ -150,29 +169,28 @@ def translate_batch(segments: List[Dict[str, Any]],
         text_chunks.append(current_chunk)
         segment_tracking.append(chunk_segments)
 
-    # Translate chunks
+    # Translate chunks; each chunk is one request, and independent chunks
+    # are sent concurrently
     translator = GoogleTranslator(source=source, target=target)
-    translated_segments = []
     progress_bar = tqdm(total=len(segments), desc="Translating")
     
+    def translate_chunk(chunk_text, chunk_segments):
+        split_translations = translator.translate(chunk_text.strip()).split("|||||")
+        
+        # Verify chunk integrity
+        if len(split_translations) != len(chunk_segments):
+            logger.warning(
+                f"Chunk translation mismatch. Expected {len(chunk_segments)}, "
+                f"got {len(split_translations)}. Translating segment by segment."
+            )
+            split_translations = [translator.translate(segment.strip()) for segment in chunk_segments]
+        progress_bar.update(len(chunk_segments))
+        return [t.strip() for t in split_translations]
+    
     try:
-        for chunk_text, chunk_segments in zip(text_chunks, segment_tracking):
-            translated_chunk = translator.translate(chunk_text.strip())
-            split_translations = translated_chunk.split("|||||")
-            
-            # Verify chunk integrity
-            if len(split_translations) == len(chunk_segments):
-                progress_bar.update(len(split_translations))
-                translated_segments.extend([t.strip() for t in split_translations])
-            else:
-                logger.warning(
-                    f"Chunk translation mismatch. Expected {len(chunk_segments)}, "
-                    f"got {len(split_translations)}. Translating segment by segment."
-                )
-                for segment in chunk_segments:
-                    translated_text = translator.translate(segment.strip())
-                    translated_segments.append(translated_text.strip())
-                    progress_bar.update(1)
+        with ThreadPoolExecutor(max_workers=min(4, len(text_chunks)) or 1) as executor:
+            chunk_results = list(executor.map(translate_chunk, text_chunks, segment_tracking))
+        translated_segments = list(chain.from_iterable(chunk_results))
         
         progress_bar.close()
         
@@ -184,11 +202,90 @@ def translate_batch(segments: List[Dict[str, Any]],
         logger.error(f"Batch translation failed: {error}")
         return translate_iterative(segments, target_lang, source_lang)
 
+GROQ_TRANSLATION_TEMPLATE = """
+        You are a professional translator. Translate the following text segments from {source_language} to {target_language}.
+        
+        IMPORTANT INSTRUCTIONS:
+        1. Preserve the meaning, tone, and style of the original text
+        2. Only respond with JSON in the exact format shown below
+        3. Each numbered segment should be translated separately
+        4. Maintain the original numbering in your response
+        5. Translated Segments should be short and concise
+        6. the translated segment should be of similar size as input.
+        
+        Text to translate:
+        {text_segments}
+        
+        The response should be ONLY a JSON array with this exact structure:
+        [
+          "translated segment 1",
+          "translated segment 2",
+          ...
+        ]
+        """
+
+# The JSON array in a Groq batch response
+_JSON_ARRAY_RE = re.compile(r'\[.*\]', re.DOTALL)
+
+def _parse_groq_response(response: str) -> List[str]:
+    """Extract the JSON array of translations from a Groq response."""
+    # First try to find JSON in the response using regex
+    json_match = _JSON_ARRAY_RE.search(response.strip())
+    
+    if json_match:
+        try:
+            return json.loads(json_match.group(0))
+        except:
+            # If regex json extraction fails, try direct parsing
+            return json.loads(response.strip())
+    # If no JSON array found, try to parse directly
+    return json.loads(response.strip())
+
+def _is_rate_limit_error(error: Exception) -> bool:
+    """Check whether an exception raised by the Groq client is a rate-limit (HTTP 429) error."""
+    return type(error).__name__ == "RateLimitError" or getattr(error, "status_code", None) == 429
+
+def _translate_groq_batch(llm: Any,
+                          batch_texts: List[str],
+                          source_language: str,
+                          target_language: str,
+                          max_retries: int = 5) -> List[str]:
+    """
+    Translate one batch of texts with a single Groq API call.
+    
+    Rate-limit errors are retried with exponential backoff; any other error
+    (or a response that doesn't parse) is raised to the caller.
+    """
+    # Create numbered text array for the prompt
+    numbered_texts = [f"{i+1}. {text}" for i, text in enumerate(batch_texts)]
+    batch_content = "\n".join(numbered_texts)
+    
+    prompt = ChatPromptTemplate.from_messages([("system", GROQ_TRANSLATION_TEMPLATE)])
+    chain = LLMChain(llm=llm, prompt=prompt)
+    
+    for attempt in range(max_retries + 1):
+        try:
+            response = chain.run(
+                source_language=source_language,
+                target_language=target_language,
+                text_segments=batch_content
+            )
+            break
+        except Exception as error:
+            if not _is_rate_limit_error(error) or attempt == max_retries:
+                raise
+            delay = 2 ** attempt + random.random()
+            logger.warning(f"Groq rate limit hit, retrying in {delay:.1f}s")
+            time.sleep(delay)
+    
+    return _parse_groq_response(response)
+
 def translate_with_groq(segments: List[Dict[str, Any]],
                        target_lang: str,
                        model_name: str = "llama-3.3-70b-versatile",
                        source_lang: Optional[str] = None,
-                       batch_size: int = 10) -> List[Dict[str, Any]]:
+                       batch_size: int = 10,
+                       max_concurrency: int = 8) -> List[Dict[str, Any]]:
     """
     Translate text segments using Groq API.
     
@@ -198,6 +295,7 @@ def translate_with_groq(segments: List[Dict[str, Any]],
         model_name: Groq model to use (default: "llama-3.3-70b-versatile")
         source_lang: Source language code (optional)
         batch_size: Number of segments to process in each API call
+        max_concurrency: Maximum number of API calls in flight at once
         
     Returns:
         List of segments with translated text
@@ -212,120 +310,230 @@ def translate_with_groq(segments: List[Dict[str, Any]],
     
     logger.info(f"Translating {len(segments)} segments from {source_language} to {target_language} using Groq")
     
-    # Set up Groq LLM
+    # Set up Groq LLM (one client, so all threads share its HTTP connection pool)
     llm = ChatGroq(model_name=model_name, temperature=0.2)
     
-    # Process segments in batches
-    translated_segments = []
-    total_batches = (len(segments) + batch_size - 1) // batch_size
+    # Look up cached translations; only unique, uncached texts hit the API
+    texts = [segment["text"].strip() for segment in segments]
+    keys = [_groq_cache_key(text, target_lang, model_name) for text in texts]
+    cache = _load_groq_translations(keys)
+    pending = [(key, text) for key, text in dict(zip(keys, texts)).items() if key not in cache]
+    fallback = {}  # Google fallback results are used for this run but not cached
     
-    for batch_idx in tqdm(range(total_batches), desc="Translating batches"):
-        start_idx = batch_idx * batch_size
-        end_idx = min(start_idx + batch_size, len(segments))
-        batch = segments[start_idx:end_idx]
-        
-        # Extract text from segments
-        batch_texts = [segment["text"].strip() for segment in batch]
-        
-        # Create numbered text array for the prompt
-        numbered_texts = [f"{i+1}. {text}" for i, text in enumerate(batch_texts)]
-        batch_content = "\n".join(numbered_texts)
-        
-        # Create a prompt template for translation
-        template = """
-        You are a professional translator. Translate the following text segments from {source_language} to {target_language}.
-        
-        IMPORTANT INSTRUCTIONS:
-        1. Preserve the meaning, tone, and style of the original text
-        2. Only respond with JSON in the exact format shown below
-        3. Each numbered segment should be translated separately
-        4. Maintain the original numbering in your response
-        5. Translated Segments should be short and concise
-        6. the translated segment should be of similar size as input.
-        
-        Text to translate:
-        {text_segments}
-        
-        The response should be ONLY a JSON array with this exact structure:
-        [
-          "translated segment 1",
-          "translated segment 2",
-          ...
-        ]
-        """
-        
-        prompt = ChatPromptTemplate.from_messages([("system", template)])
+    logger.info(f"{len(texts) - len(pending)} segments served from cache, {len(pending)} unique texts to translate")
+    
+    # Split pending texts into batches and send them concurrently
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+        futures = {
+            executor.submit(_translate_groq_batch, llm, [text for _, text in batch], source_language, target_language): batch
+            for batch in batches
+        }
         
-        try:
-            # Create a chain and execute
-            chain = LLMChain(llm=llm, prompt=prompt)
-            response = chain.run(
-                source_language=source_language,
-                target_language=target_language,
-                text_segments=batch_content
-            )
+        for batch_idx, future in enumerate(tqdm(as_completed(futures), total=len(futures), desc="Translating batches")):
+            batch = futures[future]
+            batch_texts = [text for _, text in batch]
             
-            # Parse the response
-            # First try to find JSON in the response using regex
-            import re
-            json_match = re.search(r'\[.*\]', response.strip(), re.DOTALL)
-            
-            if json_match:
-                try:
-                    translated_texts = json.loads(json_match.group(0))
-                except:
-                    # If regex json extraction fails, try direct parsing
-                    translated_texts = json.loads(response.strip())
-            else:
-                # If no JSON array found, try to parse directly
-                translated_texts = json.loads(response.strip())
-            
-            # Verify correct count
-            if len(translated_texts) != len(batch):
+            try:
+                translated_texts = future.result()
+                
+                # Verify correct count
+                if len(translated_texts) == len(batch):
+                    # Add translations to the cache
+                    _store_groq_translations(cache, batch, translated_texts)
+                    continue
+                
                 logger.warning(
                     f"Translation count mismatch. Expected {len(batch)}, "
                     f"got {len(translated_texts)}. Falling back to Google Translate for this batch."
                 )
-                # Fall back to Google for this batch
-                fallback_translations = translate_iterative(batch, target_lang, source_lang)
-                translated_texts = [segment["text"] for segment in fallback_translations]
+            except Exception as error:
+                logger.error(f"Groq translation error for batch {batch_idx+1}/{len(batches)}: {error}")
+                logger.warning("Falling back to Google Translate for this batch")
             
-            # Add translations to the result
-            translated_segments.extend(translated_texts)
+            # Fall back to Google for this batch
+            fallback_translations = translate_iterative([{"text": text} for text in batch_texts], target_lang, source_lang)
+            fallback.update((key, segment["text"]) for (key, _), segment in zip(batch, fallback_translations))
+    
+    # Fan the unique translations back out to every segment
+    translated_segments = [cache[key] if key in cache else fallback[key] for key in keys]
+    
+    # Verify and update segments
+    return verify_translation(segments, segments_copy, translated_segments, target_lang, source_lang)
+
+def translate_with_groq_batch(segments: List[Dict[str, Any]],
+                             target_lang: str,
+                             model_name: str = "llama-3.3-70b-versatile",
+                             source_lang: Optional[str] = None,
+                             batch_size: int = 10,
+                             poll_interval: float = 10.0,
+                             max_wait: float = 30 * 60) -> List[Dict[str, Any]]:
+    """
+    Translate text segments as a single offline Groq Batch API job.
+    
+    Batch jobs don't count against per-minute rate limits and are billed at a
+    discount, which suits long clips where the user is waiting on the whole
+    pipeline anyway. Falls back to the real-time Groq path if the job fails or
+    doesn't finish within `max_wait` seconds.
+    
+    Args:
+        segments: List of dictionaries with 'text' key
+        target_lang: Target language code
+        model_name: Groq model to use (default: "llama-3.3-70b-versatile")
+        source_lang: Source language code (optional)
+        batch_size: Number of segments per chat completion request in the job
+        poll_interval: Seconds between job status checks
+        max_wait: Maximum seconds to wait for the job to complete
+        
+    Returns:
+        List of segments with translated text
+    """
+    from groq import Groq
+    
+    segments_copy = copy.deepcopy(segments)
+    
+    target_language = ISO_LANGUAGE_CODES.get(fix_language_code(target_lang), "the target language")
+    source_language = "auto-detected language"
+    if source_lang:
+        source_language = ISO_LANGUAGE_CODES.get(fix_language_code(source_lang), "the source language")
+    
+    # Same cache and dedupe as the real-time path
+    texts = [segment["text"].strip() for segment in segments]
+    keys = [_groq_cache_key(text, target_lang, model_name) for text in texts]
+    cache = _load_groq_translations(keys)
+    pending = [(key, text) for key, text in dict(zip(keys, texts)).items() if key not in cache]
+    batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+    
+    logger.info(f"Submitting {len(pending)} unique texts as a Groq batch job ({len(batches)} requests)")
+    
+    if batches:
+        try:
+            client = Groq()
+            
+            # One chat completion request per batch of texts, identified by its index
+            requests_jsonl = "\n".join(
+                json.dumps({
+                    "custom_id": str(batch_idx),
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {
+                        "model": model_name,
+                        "temperature": 0.2,
+                        "messages": [{
+                            "role": "system",
+                            "content": GROQ_TRANSLATION_TEMPLATE.format(
+                                source_language=source_language,
+                                target_language=target_language,
+                                text_segments="\n".join(f"{i+1}. {text}" for i, (_, text) in enumerate(batch))
+                            )
+                        }]
+                    }
+                }, ensure_ascii=False)
+                for batch_idx, batch in enumerate(batches)
+            )
             
-            # Avoid hitting rate limits
-            time.sleep(0.5)
+            input_file = client.files.create(
+                file=("syncdub_translation_batch.jsonl", requests_jsonl.encode("utf-8")),
+                purpose="batch"
+            )
+            job = client.batches.create(
+                input_file_id=input_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h"
+            )
             
-        except Exception as error:
-            logger.error(f"Groq translation error for batch {batch_idx+1}/{total_batches}: {error}")
-            logger.warning("Falling back to Google Translate for this batch")
+            # Poll until the job reaches a terminal state
+            start_time = time.time()
+            while job.status not in ("completed", "failed", "expired", "cancelled"):
+                if time.time() - start_time > max_wait:
+                    client.batches.cancel(job.id)
+                    raise TimeoutError(f"Groq batch job {job.id} did not finish within {max_wait:.0f}s")
+                time.sleep(poll_interval)
+                job = client.batches.retrieve(job.id)
+                logger.info(f"Groq batch job {job.id}: {job.status}")
             
-            # Fall back to Google for this batch
-            fallback_translations = translate_iterative(batch, target_lang, source_lang)
-            batch_translations = [segment["text"] for segment in fallback_translations]
-            translated_segments.extend(batch_translations)
+            if job.status != "completed" or not job.output_file_id:
+                raise RuntimeError(f"Groq batch job {job.id} ended with status '{job.status}'")
+            
+            # Reassemble the results by custom_id
+            output = client.files.content(job.output_file_id).read().decode("utf-8")
+            for line in output.splitlines():
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                batch = batches[int(result["custom_id"])]
+                try:
+                    content = result["response"]["body"]["choices"][0]["message"]["content"]
+                    translated_texts = _parse_groq_response(content)
+                except Exception as error:
+                    logger.warning(f"Could not parse Groq batch result {result.get('custom_id')}: {error}")
+                    continue
+                if len(translated_texts) == len(batch):
+                    _store_groq_translations(cache, batch, translated_texts)
+                else:
+                    logger.warning(
+                        f"Translation count mismatch in batch result {result['custom_id']}. "
+                        f"Expected {len(batch)}, got {len(translated_texts)}."
+                    )
+        except Exception as error:
+            logger.error(f"Groq batch translation failed: {error}")
     
-    # Verify and update segments
+    # Anything still missing goes through the real-time path (which reuses the cache)
+    if any(key not in cache for key in keys):
+        logger.warning("Translating remaining segments with the real-time Groq API")
+        return translate_with_groq(segments, target_lang, model_name=model_name,
+                                   source_lang=source_lang, batch_size=batch_size)
+    
+    translated_segments = [cache[key] for key in keys]
     return verify_translation(segments, segments_copy, translated_segments, target_lang, source_lang)
 
+def _translate_unique(segments: List[Dict[str, Any]], translate) -> List[Dict[str, Any]]:
+    """
+    Translate each distinct segment text once and fan the result out to every
+    segment that repeats it (backchannels, names, recurring phrases).
+
+    Args:
+        segments: List of dictionaries with 'text' key
+        translate: Callable translating a list of segments
+
+    Returns:
+        List of segments with translated text
+    """
+    texts = [segment["text"].strip() for segment in segments]
+    unique_texts = list(dict.fromkeys(texts))
+    if len(unique_texts) == len(texts):
+        return translate(segments)
+
+    logger.info(f"Translating {len(unique_texts)} unique texts for {len(texts)} segments")
+    translated = translate([{"text": text} for text in unique_texts])
+    mapping = {text: segment["text"] for text, segment in zip(unique_texts, translated)}
+
+    segments_copy = copy.deepcopy(segments)
+    for segment, text in zip(segments_copy, texts):
+        segment["text"] = mapping[text]
+    return segments_copy
+
 def translate_text(segments: List[Dict[str, Any]],
                   target_lang: str,
                   translation_method: str = "batch",
                   chunk_size: int = 4000,
                   source_lang: Optional[str] = None,
                   groq_model: str = "llama-3.3-70b-versatile",
-                  groq_batch_size: int = 10) -> List[Dict[str, Any]]:
+                  groq_batch_size: int = 10,
+                  groq_concurrency: int = 8) -> List[Dict[str, Any]]:
     """
     Main translation function that handles different translation methods.
     
     Args:
         segments: List of dictionaries with 'text' key
         target_lang: Target language code
-        translation_method: "batch", "iterative", or "groq" (default: "batch")
+        translation_method: "batch", "iterative", "groq" or "groq_batch" (default: "batch")
         chunk_size: Maximum character count per chunk for batch translation
         source_lang: Source language code (defaults to auto-detect)
         groq_model: Model name for Groq translation
         groq_batch_size: Batch size for Groq translation
+        groq_concurrency: Maximum concurrent Groq API calls
         
     Returns:
         List of segments with translated text
@@ -334,21 +542,32 @@ def translate_text(segments: List[Dict[str, Any]],
         logger.warning("No segments to translate")
         return segments
     
+    # The Groq paths dedupe against their own cache; Google Translate gets
+    # one request per distinct text
     if translation_method == "batch":
-        return translate_batch(segments, target_lang, chunk_size, source_lang)
+        return _translate_unique(segments, lambda s: translate_batch(s, target_lang, chunk_size, source_lang))
     elif translation_method == "iterative":
-        return translate_iterative(segments, target_lang, source_lang)
+        return _translate_unique(segments, lambda s: translate_iterative(s, target_lang, source_lang))
     elif translation_method == "groq":
         return translate_with_groq(
             segments, 
             target_lang, 
             model_name=groq_model,
             source_lang=source_lang,
+            batch_size=groq_batch_size,
+            max_concurrency=groq_concurrency
+        )
+    elif translation_method == "groq_batch":
+        return translate_with_groq_batch(
+            segments,
+            target_lang,
+            model_name=groq_model,
+            source_lang=source_lang,
             batch_size=groq_batch_size
         )
     else:
         logger.error(f"Unknown translation method: {translation_method}")
-        return translate_batch(segments, target_lang, chunk_size, source_lang)
+        return _translate_unique(segments, lambda s: translate_batch(s, target_lang, chunk_size, source_lang))
     
 def generate_srt_subtitles(segments, output_file="output.srt"):
     """
@@ -371,21 +590,23 @@ def generate_srt_subtitles(segments, output_file="output.srt"):
         milliseconds = int((seconds - int(seconds)) * 1000)
         return f"{hours:02d}:{minutes:02d}:{int(seconds):02d},{milliseconds:03d}"
     
-    with open(output_file, "w", encoding="utf-8") as f:
-        for i, segment in enumerate(segments, 1):
-            # Extract timing information
-            start_time = segment.get("start", 0)
-            end_time = segment.get("end", 0)
-            text = segment.get("text", "").strip()
+    # Build all cues in memory and write the file in one call
+    entries = []
+    for i, segment in enumerate(segments, 1):
+        # Extract timing information
+        start_time = segment.get("start", 0)
+        end_time = segment.get("end", 0)
+        text = segment.get("text", "").strip()
+        
+        # Skip empty segments
+        if not text:
+            continue
             
-            # Skip empty segments
-            if not text:
-                continue
-                
-            # Write subtitle entry
-            f.write(f"{i}\n")
-            f.write(f"{format_time(start_time)} --> {format_time(end_time)}\n")
-            f.write(f"{text}\n\n")
+        # Subtitle entry
+        entries.append(f"{i}\n{format_time(start_time)} --> {format_time(end_time)}\n{text}\n\n")
+    
+    with open(output_file, "w", encoding="utf-8") as f:
+        f.write("".join(entries))
     
     logger.info(f"SRT subtitle file created successfully: {output_file}")
     return output_file